@@ -0,0 +1,151 @@
+## Structured Append: data split over up to 16 linked symbols instead of one huge one
+# every symbol starts with a header holding its position, the symbol count and a parity byte
+# of the whole data, so a reader can put the set back together in order and check it
+from itertools import repeat
+from math import ceil, sqrt
+
+import numpy as np
+
+from basic import DataTooLong, EncodeOptions, check_ecc_level, check_renderer, encode_symbol, image_bytes
+from batch import get_pool
+from overlay import DEFAULT_LOGO, composite_logo, rgb_png
+from reader import SymbolError, segments_bytes
+from render import render_png, render_svg
+from segments import BYTE, STRUCTURED_APPEND_BITS, Segment, make_segments, segment_bits, version_class
+from tables import DATA_CAPACITY_BITS, MAX_VERSION
+
+MAX_SYMBOLS = 16   # the header has 4 bits for the symbol count
+QUIET_ZONE = 4
+
+def parity(data):
+    # xor of every byte of the data, text counts as its UTF-8 bytes
+    value = 0
+    for byte in data.encode('utf-8') if isinstance(data, str) else bytes(data):
+        value ^= byte
+    return value
+
+def _fits(part, ecc_level, V):
+    # part plus a header fits in version V; checked with V's count widths, which are the
+    # widest any version up to V uses, so anything that passes fits in some version <= V
+    cls = version_class(V)
+    segments = make_segments(part, cls) if isinstance(part, str) else [Segment(BYTE, bytes(part))]
+    return STRUCTURED_APPEND_BITS + sum(segment_bits(s, cls) for s in segments) <= DATA_CAPACITY_BITS[ecc_level][V - 1]
+
+def _longest_prefix(data, start, ecc_level, V):
+    # end of the longest data[start:end] that fits
+    fits, too_long = start, len(data) + 1
+    while too_long - fits > 1:
+        middle = (fits + too_long) // 2
+        if _fits(data[start:middle], ecc_level, V):
+            fits = middle
+        else:
+            too_long = middle
+    return fits
+
+def split_data(data, ecc_level='H', max_version=MAX_VERSION, max_symbols=MAX_SYMBOLS):
+    # parts that each fit in max_version at ecc_level, as few as possible and as even as the modes allow
+    parts = []
+    start = 0
+    while start < len(data) or not parts:
+        end = _longest_prefix(data, start, ecc_level, max_version)
+        if end == start and data:
+            raise DataTooLong("a single character doesn't fit in version %d at ECC level %s" % (max_version, ecc_level))
+        parts.append(data[start:end])
+        start = end
+        if len(parts) > max_symbols:
+            raise DataTooLong("data needs more than %d version %d symbols at ECC level %s"
+                              % (max_symbols, max_version, ecc_level))
+
+    # the greedy split leaves a short last part, even lengths usually fit in the same count
+    n = len(parts)
+    even = [data[len(data) * i // n:len(data) * (i + 1) // n] for i in range(n)]
+    if all(_fits(part, ecc_level, max_version) for part in even):
+        return even
+    return parts
+
+def _encode_part(part, header, options, render):
+    # image bytes, or (modules, logo area) when the parent lays out a sheet
+    grid, layout, ecc_level = encode_symbol(part, options._replace(append=header))
+    if render:
+        return image_bytes(grid, layout, ecc_level, options)
+    return grid.modules, layout.logo_area
+
+def _encode_all(data, options, max_version, workers, render):
+    check_ecc_level(options.ecc_level)  # split_data looks the level up before any symbol is encoded
+    parts = split_data(data, options.ecc_level, max_version)
+    if len(parts) == 1:
+        # fits in one symbol, nothing to link
+        return [_encode_part(parts[0], None, options, render)]
+    check = parity(data)
+    headers = [(i, len(parts), check) for i in range(len(parts))]
+    # every part is close to max_version, worth the round trip to the pool even for two
+    return list(get_pool(workers).map(_encode_part, parts, headers, repeat(options), repeat(render)))
+
+def encode_images(data, ecc_level='H', logoBool=False, renderer='png', max_version=MAX_VERSION, workers=None):
+    # one image per symbol, in sequence order
+    check_renderer(renderer)
+    options = EncodeOptions(ecc_level, bool(logoBool), renderer)
+    return _encode_all(data, options, max_version, workers, True)
+
+def encode_sheet(data, ecc_level='H', logoBool=False, renderer='png', max_version=MAX_VERSION, columns=None,
+                 workers=None, image_path=DEFAULT_LOGO):
+    # every symbol on one png or svg, left to right then top to bottom
+    if renderer not in ('png', 'svg'):
+        raise ValueError('a sheet is rendered as png or svg, not %r' % renderer)
+    options = EncodeOptions(ecc_level, bool(logoBool), renderer, image_path)
+    return render_sheet(_encode_all(data, options, max_version, workers, False), renderer, columns, image_path)
+
+def sheet_layout(symbols, columns=None):
+    # (sheet modules, top left corner of every symbol), symbols in equal cells a quiet zone apart
+    columns = columns or ceil(sqrt(len(symbols)))
+    rows = ceil(len(symbols) / columns)
+    cell = max(modules.shape[0] for modules, _ in symbols) + QUIET_ZONE
+    sheet = np.zeros((rows * cell - QUIET_ZONE, columns * cell - QUIET_ZONE), dtype=np.uint8)
+    corners = []
+    for i, (modules, _) in enumerate(symbols):
+        top, left = i // columns * cell, i % columns * cell
+        sheet[top:top + modules.shape[0], left:left + modules.shape[1]] = modules
+        corners.append((top, left))
+    return sheet, corners
+
+def render_sheet(symbols, renderer='png', columns=None, image_path=DEFAULT_LOGO, scale=10):
+    # symbols as [(modules, logo area)] from _encode_part
+    sheet, corners = sheet_layout(symbols, columns)
+    if renderer == 'svg':
+        return render_svg(sheet, scale, QUIET_ZONE)
+    if not any(area for _, area in symbols):
+        return render_png(sheet, scale, QUIET_ZONE)
+
+    light = np.pad((1 - sheet) * 255, QUIET_ZONE, constant_values=255).astype(np.uint8)
+    light = light.repeat(scale, axis=0).repeat(scale, axis=1)
+    pixels = np.repeat(light[:, :, None], 3, axis=2)
+    for (modules, area), (top, left) in zip(symbols, corners):
+        if area:
+            # the symbol with its own quiet zone, as a view so the logo lands in the sheet
+            side = (modules.shape[0] + 2 * QUIET_ZONE) * scale
+            tile = pixels[top * scale:top * scale + side, left * scale:left * scale + side]
+            composite_logo(tile, area, scale, QUIET_ZONE, image_path)
+    return rgb_png(pixels)
+
+def join_symbols(decoded):
+    # text of a set of reader.Decoded symbols in any order, SymbolError if one is missing or the parity is off
+    headers = {}
+    for symbol in decoded:
+        header = next((value for name, value in symbol.segments if name == 'structured_append'), None)
+        if header is None:
+            if len(decoded) == 1:
+                return symbol.text
+            raise SymbolError('symbol without a Structured Append header in a set of %d' % len(decoded))
+        headers[header[0]] = header, symbol
+    (_, total, check), _ = next(iter(headers.values()))
+    missing = [i for i in range(total) if i not in headers]
+    if missing:
+        raise SymbolError('symbols %s of %d are missing' % (', '.join(str(i + 1) for i in missing), total))
+    if any(header[1:] != (total, check) for header, _ in headers.values()):
+        raise SymbolError('symbols come from different sets')
+    symbols = [headers[i][1] for i in range(total)]
+    # parity over the raw bytes, so sets made from bytes that aren't UTF-8 check out too
+    actual = parity(b''.join(segments_bytes(symbol.segments) for symbol in symbols))
+    if actual != check:
+        raise SymbolError('parity is %02x, the headers say %02x' % (actual, check))
+    return ''.join(symbol.text for symbol in symbols)
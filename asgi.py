@@ -0,0 +1,115 @@
+## ASGI entry point with the same /receive contract as server,py: uvicorn asgi:app
+# encoding runs on an executor so the event loop only moves bytes around; once
+# QR_MAX_IN_FLIGHT encodes are running new ones get a 503 straight away instead of queueing
+import asyncio
+import base64
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from basic import DataTooLong, encode_image
+from batch import get_pool
+from cache import ResultCache, cache_key
+from shared import install_from_env
+
+EXECUTOR = os.environ.get('QR_EXECUTOR', 'process')  # 'process' or 'thread'
+WORKERS = int(os.environ.get('QR_WORKERS', os.cpu_count()))
+MAX_IN_FLIGHT = int(os.environ.get('QR_MAX_IN_FLIGHT', WORKERS * 2))
+MAX_BODY = 64 * 1024  # a V40 symbol holds under 3 KB, anything much bigger isn't a real request
+RETRY_AFTER = b'1'
+
+cache = ResultCache(max_bytes=int(os.environ.get('QR_CACHE_BYTES', 64 * 1024 * 1024)),
+                    spill_dir=os.environ.get('QR_CACHE_DIR'))
+
+install_from_env()  # QR_SHARED_FILE, see shared.py
+
+_executor = None
+_slots = None
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = get_pool(WORKERS) if EXECUTOR == 'process' else ThreadPoolExecutor(WORKERS)
+    return _executor
+
+def get_slots():
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(MAX_IN_FLIGHT)
+    return _slots
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*'),
+                (b'access-control-allow-methods', b'POST, OPTIONS'),
+                (b'access-control-allow-headers', b'content-type')]
+
+async def send_response(send, status, body=b'', content_type=b'application/json', headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())]
+                           + CORS_HEADERS + list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_json(send, status, value, headers=()):
+    await send_response(send, status, json.dumps(value).encode('utf-8'), headers=headers)
+
+async def read_body(receive):
+    # None once the body goes past MAX_BODY
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY:
+            return None
+        if not message.get('more_body'):
+            return body
+
+async def receive_data(receive, send):
+    body = await read_body(receive)
+    if body is None:
+        return await send_json(send, 413, {"error": "request too large"})
+    try:
+        user_input = json.loads(body)['data']
+    except (ValueError, KeyError, TypeError):
+        return await send_json(send, 400, {"error": "expected {\"data\": ...}"})
+    if not isinstance(user_input, str):
+        return await send_json(send, 400, {"error": "data must be a string"})
+
+    key = cache_key(user_input)
+    image = cache.get(key)
+    if image is None:
+        slots = get_slots()
+        if slots.locked():
+            # every slot is busy, tell the client now rather than letting the queue grow
+            return await send_json(send, 503, {"error": "busy"}, [(b'retry-after', RETRY_AFTER)])
+        try:
+            async with slots:
+                image = await asyncio.get_running_loop().run_in_executor(get_executor(), encode_image, user_input)
+        except DataTooLong as e:
+            return await send_json(send, 413, {"error": str(e)})
+        cache.put(key, image)
+
+    await send_json(send, 200, {"image": base64.b64encode(image).decode('ascii')})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            get_executor()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _executor is not None:
+                _executor.shutdown(wait=False, cancel_futures=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    if scope['path'] != '/receive':
+        return await send_json(send, 404, {"error": "not found"})
+    if scope['method'] == 'OPTIONS':
+        return await send_response(send, 204) # CORS preflight
+    if scope['method'] != 'POST':
+        return await send_json(send, 405, {"error": "method not allowed"}, [(b'allow', b'POST, OPTIONS')])
+    await receive_data(receive, send)
@@ -1,92 +1,114 @@
+## matplotlib (and Pillow, through overlay) are imported by the renderers that use them,
+## so encoding and the PNG / SVG renderers start without them
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')  # Use a non-GUI backend
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
-from matplotlib.offsetbox import OffsetImage, AnnotationBbox
 import io
 import base64
-import reedsolo
+import logging
+import os
+import random
 import sys
+import threading
+from collections import namedtuple
+from functools import lru_cache
+from bitbuffer import BitBuffer
+from masking import check_mask, select_mask
+from metrics import stage
+from matrix import QRMatrix
+from overlay import DEFAULT_LOGO, load_logo, render_png_with_logo, scaled_logo
+from reader import SymbolError, verify_symbol
+from render import check_raster_format, render_png, render_svg, write_raster
+from rs import rs_encode, rs_encode_batch
+from segments import (BYTE, CHARACTER_CAPACITY, STRUCTURED_APPEND_BITS, VERSION_CLASSES, Segment, append_header,
+                      append_segments, make_segments, segment_bits, version_class)
+from tables import (ALIGNMENT_POSITIONS, DATA_CAPACITY_BITS, ECC_CODEWORDS_PER_BLOCK, ECC_LEVELS, FORMAT_WORDS,
+                    MAX_VERSION, NUM_BLOCKS, VERSION_WORDS, block_lengths, smallest_version, symbol_size)
+
+## silent unless the application configures logging, e.g. logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger('qr')
+log.addHandler(logging.NullHandler())
+
+## share of symbols read back and checked before they're returned, 0 = off, 1 = all
+VERIFY_RATE = float(os.environ.get('QR_VERIFY_RATE', 0))
+
+def generate_error_corrected_codewords(data_bytes, V, ecc_level):
+    ecc_codewords = ECC_CODEWORDS_PER_BLOCK[ecc_level][V] # per block
+
+    # split into blocks, short blocks first
+    data_blocks = []
+    start = 0
+    for length in block_lengths(V, ecc_level):
+        data_blocks.append(data_bytes[start:start+length])
+        start += length
+    if len(data_blocks) >= 4:
+        ecc_blocks = rs_encode_batch(data_blocks, ecc_codewords) # one vectorized pass over all blocks
+    else:
+        ecc_blocks = [rs_encode(block, ecc_codewords) for block in data_blocks]
+
+    # interleave, codeword i of every block, then ecc codeword i of every block
+    blocks = len(data_blocks)
+    short = len(data_blocks[0])
+    full = bytearray(start + ecc_codewords * blocks)
+    for b, block in enumerate(data_blocks):
+        full[b:short*blocks:blocks] = block[:short]
+    long_blocks = [block[short] for block in data_blocks if len(block) > short]
+    full[short*blocks:start] = bytes(long_blocks)  # only the long blocks have a last codeword
+    for b, ecc in enumerate(ecc_blocks):
+        full[start+b::blocks] = ecc
+    return bytes(full)
+
+class DataTooLong(ValueError):
+    # the text doesn't fit in version 40 even at ECC level L
+    pass
+
+def build_qr_payload(data, ecc_level='L', V=1, header=None):
+    # data is a str, split into the cheapest mix of modes, or bytes, sent as one byte mode segment;
+    # header=(index, total, parity) makes it one symbol of a Structured Append set, see append.py
+    if isinstance(data, str):
+        make = lambda version_cls: make_segments(data, version_cls)
+    elif isinstance(data, (bytes, bytearray)):
+        make = lambda version_cls: [Segment(BYTE, bytes(data))]
+    else:
+        # bytes(5) would be five NUL bytes, not the text '5'
+        raise TypeError('data must be str or bytes, not %s' % type(data).__name__)
 
-def generate_error_corrected_codewords(data_bytes, ecc_codewords):
-    rs = reedsolo.RSCodec(ecc_codewords)
-    encoded_data = rs.encode(bytes(data_bytes))  # returns data + ecc
-    ecc = encoded_data[-ecc_codewords:]          # extract only ECC portion
-    full = data_bytes + list(ecc)                # combine data + ecc
-    corrected_bits = ''.join(format(byte, '08b') for byte in full)  # convert to bit string
-    return corrected_bits
-
-def build_qr_payload(data_bytes, ecc_level='L', V=1):
-    bits = '0100'  # byte mode
-    bits += format(len(data_bytes), '08b')  # character count
-
-    for byte in data_bytes:
-        bits += format(byte, '08b')  # data bits assembly
-
-    bits += '0000'  # terminator if room / padding
-
-    while len(bits) % 8 != 0:
-        bits += '0'
-
-    # Pad with alternating bytes to reach 152 bits
-    pad_bytes = ['11101100', '00010001']
-    print(bits)
-
-    def check_len():
-        print("len = ", len(bits), " | vlen = ", vlen)
-        if len(bits) > vlen:
-            return True
-        else:
-            return False
-        
-    vlen = 152
-    ecc_table = {
-        (1, 'L'): 152, (1, 'M'): 128, (1, 'Q'): 104, (1, 'H'): 72,
-        (2, 'L'): 272, (2, 'M'): 224, (2, 'Q'): 176, (2, 'H'): 128,
-        # Add more versions if needed
-    }
     ecc_order = ['H', 'Q', 'M', 'L']
-    vlen = ecc_table.get((V, ecc_level))
-    version_limit = 2
-    while True:
-        if check_len() == False:
-            break
-        index = ecc_order.index(ecc_level)
-        print('V = ', V, ' | ECC_level = ', ecc_level, " | vlen = ", vlen, " | ", "length of bits = ", len(bits))
-        V += 1
-        print(V)
-        if V > version_limit:
-            V -= 1
-            print("Cannot go up a version so lowering ecc rate")
-            vlen = ecc_table.get((V, ecc_level))
-            if index < len(ecc_order) - 1:
-                ecc_level = ecc_order[index + 1]  # go down one level
-                vlen = ecc_table.get((V, ecc_level))
-                print('lowering ecc_level to ', ecc_level)
-            else:
-                print("Cannot lower ecc rate nor version level")
+    min_version = V
+    plans = {}  # count field widths change at V10 and V27, so each range gets its own split
+    extra = STRUCTURED_APPEND_BITS if header else 0
+    for ecc_level in ecc_order[ecc_order.index(ecc_level):]:
+        for version_cls, (first, last) in enumerate(VERSION_CLASSES):
+            if last < min_version:
+                continue
+            if version_cls not in plans:
+                segments = make(version_cls)
+                plans[version_cls] = segments, extra + sum(segment_bits(segment, version_cls) for segment in segments)
+            V = smallest_version(plans[version_cls][1], ecc_level, max(min_version, first), last)
+            if V is not None:
                 break
-        vlen = ecc_table.get((V, ecc_level))
-
-    print('end', 'V = ', V, ' | ECC_level = ', ecc_level, " | vlen = ", vlen, " | ", "length of bits = ", len(bits))
-
-    i = 0
-    if V == 1:
-        while len(bits) < vlen:
-            bits += pad_bytes[i % 2]
-            i += 1
-    elif V == 2:
-        while len(bits) < vlen:
-            bits += pad_bytes[i % 2]
-            i += 1
-
-    data_codewords = [int(bits[i:i+8], 2) for i in range(0, len(bits), 8)] # splits bytes
-    print("after padding", bits)
-    return data_codewords, V, ecc_level
+        else:
+            log.info("%s doesn't fit in version 40, lowering the ECC level", ecc_level)
+            continue
+        break
+    else:
+        needed = plans[version_class(MAX_VERSION)][1]
+        raise DataTooLong("data needs %d bits, version 40 holds at most %d (%d bytes, %d alphanumeric or %d digits at ECC level L)"
+                          % (needed, DATA_CAPACITY_BITS['L'][-1], CHARACTER_CAPACITY[('byte', 'L')][-1],
+                             CHARACTER_CAPACITY[('alphanumeric', 'L')][-1], CHARACTER_CAPACITY[('numeric', 'L')][-1]))
+    vlen = DATA_CAPACITY_BITS[ecc_level][V - 1]
+    segments = plans[version_class(V)][0]
+
+    bits = BitBuffer()
+    if header:
+        append_header(bits, *header)
+    append_segments(bits, segments, version_class(V))  # mode, count and data of every segment
+
+    log.debug('V = %d | ECC level = %s | capacity = %d bits | data = %d bits', V, ecc_level, vlen, len(bits))
+
+    bits.pad_to(vlen)  # terminator, byte boundary, then alternating pad bytes to fill the version
+    return bits.to_bytes(), V, ecc_level
 
 def generate_grid(size=21):
-    grid = [[0] * size for _ in range(size)]
+    grid = QRMatrix(size)
 
     def place_finder_pattern(x, y):
         pattern = [
@@ -98,17 +120,11 @@ def generate_grid(size=21):
             [1,0,0,0,0,0,1],
             [1,1,1,1,1,1,1],
         ]
-        for i in range(7):
-            for j in range(7):
-                grid[y+i][x+j] = pattern[i][j]
+        grid[y:y+7, x:x+7] = pattern
 
     place_finder_pattern(0, 0)
-    if size == 21:
-        place_finder_pattern(14, 0)
-        place_finder_pattern(0, 14)
-    if size > 21:
-        place_finder_pattern(18, 0)
-        place_finder_pattern(0, 18)
+    place_finder_pattern(size-7, 0)
+    place_finder_pattern(0, size-7)
 
     return grid
 
@@ -128,11 +144,36 @@ def add_alignment_patterns(grid):
         [1,0,0,0,1],
         [1,1,1,1,1]
     ]
-    x = size-7-2
-    y = size-7-2
-    for i in range(5):
-        for j in range(5):
-            grid[x+i][j+y] = pattern[i][j]
+    for x, y in alignment_centres(size):
+        grid[x-2:x+3, y-2:y+3] = pattern
+
+@lru_cache(maxsize=None)
+def alignment_centres(size):
+    positions = ALIGNMENT_POSITIONS[(size - 17) // 4]
+    last = len(positions) - 1
+    # every combination except the three that land on the finder patterns
+    return frozenset((positions[i], positions[j]) for i in range(len(positions)) for j in range(len(positions))
+                     if (i, j) not in ((0, 0), (0, last), (last, 0)))
+
+def get_version_bits(V):
+    # 6 bit version + 12 bit BCH(18, 6) remainder as an int, V7 and up only
+    return VERSION_WORDS[V]
+
+@lru_cache(maxsize=None)
+def version_positions(size):
+    # rows, cols and bit numbers (0 = least significant) of both version info copies
+    i = np.arange(18)
+    rows = np.concatenate([i // 3, size - 11 + i % 3])  # top right, then bottom left
+    cols = np.concatenate([size - 11 + i % 3, i // 3])
+    return rows, cols, np.concatenate([i, i])
+
+def add_version_info(grid):
+    size = len(grid)
+    V = (size - 17) // 4
+    if V < 7:
+        return
+    rows, cols, bits = version_positions(size)
+    np.asarray(grid)[rows, cols] = (VERSION_WORDS[V] >> bits) & 1
 
 def add_dark_module(grid):
     size = len(grid)
@@ -142,46 +183,89 @@ def add_dark_module(grid):
     # elif size > 21:
     #     grid[17][8] = 1
 
-def is_reserved(r, c, size=21):
+def is_reserved(r, c, size=21, reserve_logo=False):
     if (r < 9 and c < 9) or (r < 9 and c >= size - 8) or (r >= size - 8 and c < 9):
         return True  # Finder patterns
     if c == 6 or r == 6:
         return True  # Timing patterns
     if (r, c) == (size-8, 8):
         return True  # Dark module
-    if size>21:
-        if (r > size-7-3 and r < size-4) and (c > size-7-3 and c < size-4):
-            return True
-    if logo and size>21:
-        if (r < size-10 and r > 10 and c > 10 and c < size-10):
+    positions = ALIGNMENT_POSITIONS[(size - 17) // 4]
+    near_r = [x for x in positions if abs(r - x) <= 2]
+    near_c = [y for y in positions if abs(c - y) <= 2]
+    if near_r and near_c and (near_r[0], near_c[0]) in alignment_centres(size):
+        return True  # Alignment patterns
+    if size >= 45:
+        if (r < 6 and size-11 <= c < size-8) or (c < 6 and size-11 <= r < size-8):
+            return True  # Version information
+    if reserve_logo and size>21:
+        start, stop = logo_area(size)
+        if (r >= start and r < stop and c >= start and c < stop):
             return True
     return False
 
-def add_data(grid, data):
-    size = len(grid)
+def logo_area(size):
+    # centred square for the logo, small enough for ECC to recover the modules it covers
+    side = min(size - 21, size // 4)
+    side -= (size - side) % 2
+    start = (size - side) // 2
+    return start, start + side
+
+## per-version layout, everything that doesn't depend on the payload
+Layout = namedtuple('Layout', ['version', 'size', 'grid', 'reserved', 'data_rows', 'data_cols', 'logo_area'])
+
+_layouts = {}
+_layouts_lock = threading.Lock()
+
+def build_layout(V, reserve_logo=False):
+    size = symbol_size(V)
+    grid = generate_grid(size)
+    add_timing_patterns(grid)
+    add_alignment_patterns(grid)
+    add_dark_module(grid)
+    add_version_info(grid)
+
+    # data still runs under the logo, error correction recovers what it covers
+    reserved = np.array([[bool(is_reserved(r, c, size)) for c in range(size)] for r in range(size)])
+
+    # zig-zag data path, two columns at a time from the bottom right
+    rows, cols = [], []
     direction = -1
     col = size - 1
-    bit_index = 0
-
     while col > 0:
         if col == 6:
             col -= 1
-
         for i in range(size):
             row = (size - 1 - i) if direction == -1 else i
             for offset in [0, -1]:
-                c = col + offset
-                if is_reserved(row, c, size):
-                    if logo and is_reserved(row, c, size) == 2:
-                        grid[row][c] = is_reserved(row, c, size)
-                    continue
-                if bit_index < len(data):
-                    grid[row][c] = int(data[bit_index])
-                    bit_index += 1
-
+                if not reserved[row, col + offset]:
+                    rows.append(row)
+                    cols.append(col + offset)
         col -= 2
         direction *= -1
 
+    area = logo_area(size) if reserve_logo and size > 21 else None
+    layout = Layout(V, size, grid.freeze(), reserved, np.array(rows), np.array(cols), area)
+    for array in layout[3:6]:
+        array.setflags(write=False)
+    return layout
+
+def get_layout(V, reserve_logo=False):
+    key = (V, bool(reserve_logo))
+    layout = _layouts.get(key)
+    if layout is None:
+        with _layouts_lock:
+            layout = _layouts.get(key)
+            if layout is None:
+                layout = _layouts[key] = build_layout(V, reserve_logo)
+    return layout
+
+def add_data(grid, codewords, layout=None):
+    if layout is None:
+        layout = get_layout((len(grid) - 17) // 4)
+    bits = np.unpackbits(np.frombuffer(codewords, dtype=np.uint8))
+    n = min(len(bits), len(layout.data_rows))
+    grid[layout.data_rows[:n], layout.data_cols[:n]] = bits[:n] # one scatter along the zig-zag path
     return grid
 
 def penalty_1(grid):
@@ -227,7 +311,7 @@ def penalty_3(grid):
     pattern_length = len(pattern1)
     for r in range(size):
         for c in range(size - pattern_length + 1):
-            window = grid[r][c:c+pattern_length]
+            window = list(grid[r][c:c+pattern_length])
             if window == pattern1 or window == pattern2:
                 # print("Found pattern at row", r, "col", c, ":", window)
                 penalty_score += 40
@@ -245,7 +329,7 @@ def penalty_4(grid):
     reserved_modules = 0
     for r in range(size):
         for c in range(size):
-            if is_reserved(r, c):
+            if is_reserved(r, c, size):
                 continue
             reserved_modules += 1
             if grid[r][c] == 1:
@@ -305,124 +389,96 @@ def apply_mask_pattern(grid, m=0):
     return grid_copy
 
 def get_format_bits(ec='L', mask_pattern_no=0):
-    mask_pattern = "000"
-    if mask_pattern_no == 1:
-        mask_pattern = "001"
-    elif mask_pattern_no == 2:
-        mask_pattern = "010"
-    elif mask_pattern_no == 3:
-        mask_pattern = "011"
-    elif mask_pattern_no == 4:
-        mask_pattern = "100"
-    elif mask_pattern_no == 5:
-        mask_pattern = "101"
-    elif mask_pattern_no == 6:
-        mask_pattern = "110"
-    elif mask_pattern_no == 7:
-        mask_pattern = "111"
-    
-    if ec == 'L':
-        error_correction = '01'
-    if ec == 'M':
-        error_correction = '00'
-    if ec == 'Q':
-        error_correction = '11'
-    if ec == 'H':
-        error_correction = '10'
-
-    format_data = error_correction + mask_pattern
-    format_data_value = int(format_data, 2)
-    data = format_data_value << 10
-    generator = 0b10100110111
-
-    for i in range(14, 9, -1):
-        if (data >> i) & 1:
-            data ^= generator << (i - 10)
-
-    # Combine original 5 bits and 10-bit error correction
-    full_format = (format_data_value << 10) | data
-
-    # Apply mask (0x5412)
-    masked = full_format ^ 0b101010000010010
-
-    return format(masked, '015b')
+    # 15 bit format word as an int: level + mask, BCH(15, 5) remainder, xor 0x5412
+    return FORMAT_WORDS[(ec, mask_pattern_no)]
+
+@lru_cache(maxsize=None)
+def format_positions(size):
+    # rows, cols and bit numbers (0 = least significant) of both format info copies,
+    # the dark module at (size - 8, 8) isn't part of either
+    i = np.arange(15)
+    rows = np.concatenate([
+        np.where(i < 6, i, np.where(i < 8, i + 1, 8)),   # column 8 going down, then row 8 going left
+        np.where(i < 8, 8, size - 15 + i),               # row 8 from the right, then column 8 at the bottom
+    ])
+    cols = np.concatenate([
+        np.where(i < 8, 8, np.where(i == 8, 7, 14 - i)),
+        np.where(i < 8, size - 1 - i, 8),
+    ])
+    return rows, cols, np.concatenate([i, i])
 
 def place_format_bits(grid, format_bits):
-    size = len(grid)-1
-    c = 0
-    for i in range(9):
-        if i == 6:
-            continue ## dark module
-        if i > 6:
-            grid[8][i] = int(format_bits[i-1])
-        else:
-            grid[8][i] = int(format_bits[i])
-    c=7
-    for i in reversed(range(8)):
-        if i == 6:
-            continue ## alignment area
-        if i < 6:
-            grid[i][8] = int(format_bits[1+c])
-        else:
-            grid[i][8] = int(format_bits[c])
-        c+=1
-    c=0
-    for i in range(8):
-        grid[size-i][8] = int(format_bits[i])
-    c=7
-    for i in range(8):
-        grid[8][size-7+i] = int(format_bits[i+c])
+    rows, cols, bits = format_positions(len(grid))
+    np.asarray(grid)[rows, cols] = (format_bits >> bits) & 1
 
 def calculate_ecc_codewords(V, ecc_level):
-    if V == 1 and ecc_level == 'L':
-        ecc_codewords = 7
-    if V == 1 and ecc_level == 'M':
-        ecc_codewords = 10
-    if V == 1 and ecc_level == 'Q':
-        ecc_codewords = 13
-    if V == 1 and ecc_level == 'H':
-        ecc_codewords = 17
-    if V == 2 and ecc_level == 'L':
-        ecc_codewords = 10
-    if V == 2 and ecc_level == 'M':
-        ecc_codewords = 16
-    if V == 2 and ecc_level == 'Q':
-        ecc_codewords = 22
-    if V == 2 and ecc_level == 'H':
-        ecc_codewords = 28
+    # total over all blocks
+    ecc_codewords = ECC_CODEWORDS_PER_BLOCK[ecc_level][V] * NUM_BLOCKS[ecc_level][V]
     return ecc_codewords
 
 #text = input() ## accept input string
-logo = False
-def process_input(data, ecc_level='H', logoBool=False):
-    print("Processing in processor.py:", data)
+
+## everything a request can change, passed down explicitly instead of module globals
+EncodeOptions = namedtuple('EncodeOptions', ['ecc_level', 'logo', 'renderer', 'image_path', 'mask', 'append'])
+EncodeOptions.__new__.__defaults__ = ('H', False, 'png', DEFAULT_LOGO, None, None)
+
+RENDERERS = ('png', 'svg', 'matplotlib', 'pbm', 'pgm')
+LOGO_RENDERERS = ('png', 'pbm', 'pgm')  # the ones that composite the logo, the others get a full symbol
+
+def check_renderer(renderer):
+    # before any encoding, so a typo doesn't cost a symbol or fall through to another renderer
+    if renderer not in RENDERERS:
+        raise ValueError('unknown renderer %r, expected one of %s' % (renderer, ', '.join(RENDERERS)))
+
+def check_ecc_level(ecc_level):
+    # a ValueError like the other options, not a KeyError from deep in the tables
+    if ecc_level not in ECC_LEVELS:
+        raise ValueError('unknown ECC level %r, expected one of %s' % (ecc_level, ', '.join(ECC_LEVELS)))
+
+## process_input is reentrant: it only writes to grids it creates itself, and the shared
+## caches behind it (layouts, logos, RS generators) are read-only once built, so any
+## number of threads can call it at the same time.
+def process_input(data, ecc_level='H', logoBool=False, renderer='png', mask=None):
+    # mask=0..7 skips penalty scoring and always uses that pattern
+    check_renderer(renderer)
+    options = EncodeOptions(ecc_level, bool(logoBool), renderer, mask=mask)
+    grid, layout, ecc_level = encode_symbol(data, options)
+    return render_symbol(grid, layout, ecc_level, options)
+
+def encode_image(data, ecc_level='H', logoBool=False, renderer='png', mask=None):
+    # process_input without the base64, module level so executors can pickle it
+    check_renderer(renderer)
+    options = EncodeOptions(ecc_level, bool(logoBool), renderer, mask=mask)
+    grid, layout, ecc_level = encode_symbol(data, options)
+    return image_bytes(grid, layout, ecc_level, options)
+
+def encode_symbol(data, options):
+    # QRMatrix with format info, plus the layout and final ECC level
+    check_mask(options.mask)  # before any work is done
+    check_ecc_level(options.ecc_level)
+    log.debug("encoding %r", data)
     text = data
-    global logo
-    logo = logoBool
+    ecc_level = options.ecc_level
     V = 1
 
     # if len(data) > 17:
     #     V = 2
 
-    textEncoded = bytearray(text, 'utf-8') ## to utf-8 to turn into byte mode | Correct handling of byte mode
-    print(list(textEncoded))
-
-    ecc_codewords = calculate_ecc_codewords(V, ecc_level)
-
-    padding = ["11101100", "00010001"]
-    data_codewords, V, ecc_level = build_qr_payload(textEncoded, ecc_level, V) # data_codewords [/]
-    print("codewords -> ", data_codewords)
-    print("codewords -> ", len(data_codewords))
-    ecc_codewords = calculate_ecc_codewords(V, ecc_level)
-    corrected_bits = generate_error_corrected_codewords(data_codewords, ecc_codewords) # ecc_codewords [/]
-    # print(corrected_bits) 
-    size = (((V-1)*4)+21)
-    grid = generate_grid(size)
-    add_timing_patterns(grid)
-    if V == 2:
-        add_alignment_patterns(grid) ## version 2 only
-    add_dark_module(grid)
-    add_data(grid, corrected_bits)
+    with stage('payload') as timed:
+        data_codewords, V, ecc_level = build_qr_payload(text, ecc_level, V, options.append) # numeric/alphanumeric/byte/kanji segments
+        timed.nbytes = len(data_codewords)
+    if log.isEnabledFor(logging.DEBUG): # the list is built per encode otherwise, even with debug off
+        log.debug("codewords -> %d %s", len(data_codewords), list(data_codewords))
+    with stage('ecc') as timed:
+        codewords = generate_error_corrected_codewords(data_codewords, V, ecc_level) # split into blocks and interleaved
+        timed.nbytes = len(codewords)
+    with stage('placement') as timed:
+        # level L recovers too little to read through the logo, so it's left out there; renderers
+        # that can't draw one keep the area, an empty hole would only cost error correction
+        layout = get_layout(V, options.logo and ecc_level != 'L' and options.renderer in LOGO_RENDERERS)
+        grid = layout.grid.copy()
+        add_data(grid, codewords, layout)
+        timed.nbytes = grid.modules.nbytes
 
     # apply_mask_pattern(grid)
 
@@ -436,47 +492,78 @@ def process_input(data, ecc_level='H', logoBool=False):
     # print("penalty 3 - >",  penalty_3(grid))
     # print("penalty 4 - >",  penalty_4(grid))
 
-    penalty_score_0 = penalty_1(apply_mask_pattern(grid, 0)) + penalty_2(apply_mask_pattern(grid, 0)) + penalty_3(apply_mask_pattern(grid, 0)) + penalty_4(apply_mask_pattern(grid, 0))
-    penalty_score_1 = penalty_1(apply_mask_pattern(grid, 1)) + penalty_2(apply_mask_pattern(grid, 1)) + penalty_3(apply_mask_pattern(grid, 1)) + penalty_4(apply_mask_pattern(grid, 1))
-    penalty_score_2 = penalty_1(apply_mask_pattern(grid, 2)) + penalty_2(apply_mask_pattern(grid, 2)) + penalty_3(apply_mask_pattern(grid, 2)) + penalty_4(apply_mask_pattern(grid, 2))
-    penalty_score_3 = penalty_1(apply_mask_pattern(grid, 3)) + penalty_2(apply_mask_pattern(grid, 3)) + penalty_3(apply_mask_pattern(grid, 3)) + penalty_4(apply_mask_pattern(grid, 3))
-    penalty_score_4 = penalty_1(apply_mask_pattern(grid, 4)) + penalty_2(apply_mask_pattern(grid, 4)) + penalty_3(apply_mask_pattern(grid, 4)) + penalty_4(apply_mask_pattern(grid, 4))
-    penalty_score_5 = penalty_1(apply_mask_pattern(grid, 5)) + penalty_2(apply_mask_pattern(grid, 5)) + penalty_3(apply_mask_pattern(grid, 5)) + penalty_4(apply_mask_pattern(grid, 5))
-    penalty_score_6 = penalty_1(apply_mask_pattern(grid, 6)) + penalty_2(apply_mask_pattern(grid, 6)) + penalty_3(apply_mask_pattern(grid, 6)) + penalty_4(apply_mask_pattern(grid, 6))
-    penalty_score_7 = penalty_1(apply_mask_pattern(grid, 7)) + penalty_2(apply_mask_pattern(grid, 7)) + penalty_3(apply_mask_pattern(grid, 7)) + penalty_4(apply_mask_pattern(grid, 7))
-    penalty_score = min(penalty_score_0, penalty_score_1, penalty_score_2, penalty_score_3, penalty_score_4, penalty_score_5, penalty_score_6, penalty_score_7)
-    mask = 0
-    penalty_3(grid)
-    if penalty_score == penalty_score_7:
-        mask = 7
-    elif penalty_score == penalty_score_6:
-        mask = 6
-    elif penalty_score == penalty_score_5:
-        mask = 5
-    elif penalty_score == penalty_score_4:
-        mask = 4
-    elif penalty_score == penalty_score_3:
-        mask = 3
-    elif penalty_score == penalty_score_2:
-        mask = 2
-    elif penalty_score == penalty_score_1:
-        mask = 1
-    elif penalty_score == penalty_score_0:
-        mask = 0
-
-
-    grid = apply_mask_pattern(grid, mask)
-
-    format_bits = get_format_bits(ecc_level, mask)
-    place_format_bits(grid, format_bits)
-
-    for row in grid:
-        print(''.join('🟨' if cell == 2 else '⬛' if cell == 1 else '⬜' for cell in row))
-        # print(''.join('⬛' if cell else '⬜' for cell in row))
-
-    image = visualize_qr(grid, ecc_level)
+    with stage('mask'):
+        mask, masked = select_mask(grid, layout.reserved, options.mask) # best of all 8 unless a mask is given
+        grid = QRMatrix(modules=masked)
+
+    with stage('format'):
+        format_bits = get_format_bits(ecc_level, mask)
+        place_format_bits(grid, format_bits)
+
+        if layout.logo_area:
+            start, stop = layout.logo_area
+            grid[start:stop, start:stop] = 0 # cleared for the logo
+
+    if VERIFY_RATE and random.random() < VERIFY_RATE:
+        with stage('verify'):
+            try:
+                verify_symbol(grid, text, layout.logo_area)
+            except SymbolError:
+                log.error("symbol for %r failed verification (V%d, %s, mask %d)", text, V, ecc_level, mask)
+                raise
+
+    if log.isEnabledFor(logging.DEBUG): # building the picture is the expensive part, skip it when nobody reads it
+        log.debug("mask %d\n%s", mask, '\n'.join(''.join('⬛' if cell == 1 else '⬜' for cell in row) for row in grid))
+
+    return grid, layout, ecc_level
+
+def render_symbol(grid, layout, ecc_level, options):
+    # base64 image in the format options.renderer asks for
+    return base64.b64encode(image_bytes(grid, layout, ecc_level, options)).decode('utf-8')
+
+def image_bytes(grid, layout, ecc_level, options):
+    # raw image bytes, for callers that write files instead of sending base64
+    with stage('render') as timed:
+        if options.renderer == 'png' and layout.logo_area:
+            image = render_png_with_logo(grid, layout.logo_area, path=options.image_path)
+        elif options.renderer == 'png':
+            image = render_png(grid)
+        elif options.renderer == 'svg':
+            image = render_svg(grid)
+        elif options.renderer == 'matplotlib':
+            image = figure_png(grid, ecc_level, options.image_path) # with the centre image
+        elif options.renderer in ('pbm', 'pgm'):
+            image = bytearray()
+            write_raster(grid, image, options.renderer, logo=raster_logo(layout, 10, options.image_path))
+            image = bytes(image)
+        else:
+            check_renderer(options.renderer)
+        timed.nbytes = len(image)
     return image
 
+def write_image(data, out, ecc_level='H', logoBool=False, fmt='png', scale=10, border=4, dpi=None, mask=None,
+                image_path=DEFAULT_LOGO):
+    # encode and stream the image straight to out (file object, file descriptor or bytearray),
+    # for print: exact pixels per module, quiet zone in modules, dpi; returns the bytes written
+    check_raster_format(fmt)  # before the encode, not after it
+    options = EncodeOptions(ecc_level, bool(logoBool), fmt, image_path, mask)
+    grid, layout, ecc_level = encode_symbol(data, options)
+    return write_symbol(grid, layout, out, fmt, scale, border, dpi, image_path)
+
+def write_symbol(grid, layout, out, fmt='png', scale=10, border=4, dpi=None, image_path=DEFAULT_LOGO):
+    # memory stays at about one pixel row, however big scale makes the image
+    with stage('render') as timed:
+        written = write_raster(grid, out, fmt, scale, border, dpi, raster_logo(layout, scale, image_path))
+        timed.nbytes = written
+    return written
+
+def raster_logo(layout, scale, image_path=DEFAULT_LOGO):
+    # the logo argument of write_raster, None without a logo area
+    if not layout.logo_area:
+        return None
+    start, stop = layout.logo_area
+    return layout.logo_area, scaled_logo(image_path, layout.version, scale, stop - start)
+
 def calculate_image_size(grid, ecc_level):
     size_table = {
         (1, 'L'): 0.05, (1, 'M'): 0.055, (1, 'Q'): 0.065, (1, 'H'): 0.075,
@@ -489,13 +576,22 @@ def calculate_image_size(grid, ecc_level):
     return 0
 
 def visualize_qr(grid, ecc_level, image_path="./test_image.png"):
+    return base64.b64encode(figure_png(grid, ecc_level, image_path)).decode('utf-8')
+
+def figure_png(grid, ecc_level, image_path="./test_image.png"):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # non-GUI, and no pyplot global state
+    from matplotlib.offsetbox import OffsetImage, AnnotationBbox
+
     # Create the plot
-    fig, ax = plt.subplots()
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
     ax.imshow(grid, cmap='binary')
     ax.axis('off')
     image_size = calculate_image_size(grid, ecc_level)
     # Load the image to overlay
-    center_img = mpimg.imread(image_path)
+    center_img = load_logo(image_path)[1] # decoded once, not per request
     imagebox = OffsetImage(center_img, zoom=image_size)  # control image size with zoom
 
     # Get grid center
@@ -509,13 +605,8 @@ def visualize_qr(grid, ecc_level, image_path="./test_image.png"):
 
     # Save to buffer
     buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0.25)
-    plt.close(fig)
-    buf.seek(0)
-
-    # Encode as base64
-    img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    return img_base64
+    fig.savefig(buf, format='png', bbox_inches='tight', pad_inches=0.25)
+    return buf.getvalue()
 
 
 
@@ -0,0 +1,72 @@
+## many texts at once, encode + render spread over a process pool
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from basic import check_renderer, get_layout, process_input
+from rs import generator_poly
+from shared import install_from_env
+from tables import ECC_CODEWORDS_PER_BLOCK
+
+INLINE_LIMIT = 8  # smaller batches aren't worth the round trip to the pool
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _warm_up():
+    # runs once per worker, so every item it handles reuses the same layouts and generators
+    install_from_env()  # with QR_SHARED_FILE set the layouts come mapped from the shared file
+    for V in range(1, 11):
+        get_layout(V)
+    for ecc_codewords in set(n for per_version in ECC_CODEWORDS_PER_BLOCK.values() for n in per_version[1:]):
+        generator_poly(ecc_codewords)
+
+def get_pool(workers=None):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_warm_up)
+        return _pool
+
+def _encode_one(text, ecc_level, logoBool, renderer):
+    # (image, None) or (None, error), one text that doesn't fit doesn't sink the batch
+    try:
+        return process_input(text, ecc_level, logoBool, renderer), None
+    except (ValueError, TypeError) as e:
+        return None, e
+
+def _encode_chunk(start, texts, ecc_level, logoBool, renderer):
+    return start, [_encode_one(text, ecc_level, logoBool, renderer) for text in texts]
+
+def _chunks(texts, workers):
+    size = max(1, -(-len(texts) // (workers * 4)))  # about 4 chunks per worker
+    for start in range(0, len(texts), size):
+        yield start, texts[start:start+size]
+
+def iter_batch(texts, ecc_level='H', logoBool=False, renderer='png', workers=None):
+    # yields (index, image, error) as chunks finish, not in input order; image is None
+    # and error the exception (DataTooLong, ...) for a text that couldn't be encoded
+    check_renderer(renderer)
+    texts = list(texts)
+    if len(texts) <= INLINE_LIMIT:
+        for i, text in enumerate(texts):
+            yield (i,) + _encode_one(text, ecc_level, logoBool, renderer)
+        return
+    workers = workers or os.cpu_count()
+    pool = get_pool(workers)
+    futures = [pool.submit(_encode_chunk, start, chunk, ecc_level, logoBool, renderer)
+               for start, chunk in _chunks(texts, workers)]
+    for future in as_completed(futures):
+        start, results = future.result()
+        for offset, (image, error) in enumerate(results):
+            yield start + offset, image, error
+
+def process_batch(texts, ecc_level='H', logoBool=False, renderer='png', workers=None):
+    # images in the same order as texts, raises the first error
+    texts = list(texts)
+    images = [None] * len(texts)
+    for i, image, error in iter_batch(texts, ecc_level, logoBool, renderer, workers):
+        if error is not None:
+            raise error
+        images[i] = image
+    return images
@@ -0,0 +1,274 @@
+import argparse
+import copy
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import timeit
+
+import numpy as np
+
+import basic
+from masking import select_mask
+from reader import SymbolError, read_symbol, verify_symbol
+from render import render_png, render_svg, write_raster
+from tables import DATA_CAPACITY_BITS
+
+## run with: python bench.py                      every stage over the version / ECC grid
+##           python bench.py --save base.json     keep the numbers as a baseline
+##           python bench.py --compare base.json  flag stages whose p50 got slower
+##           python bench.py masks                old vs new mask selection
+##           python bench.py imports              cold import time of basic, exit 1 over budget
+##           python bench.py fuzz --count 5000    encode random texts, read every symbol back
+##           python bench.py known                compare with symbols made by another encoder
+
+VERSIONS = (1, 5, 10, 20, 40)
+QUICK_VERSIONS = (1, 10)
+ECC_LEVELS = ('L', 'M', 'Q', 'H')
+STAGES = ('build_qr_payload', 'generate_error_corrected_codewords', 'add_data', 'select_mask',
+          'get_format_bits', 'render_png', 'render_svg', 'write_raster', 'visualize_qr', 'read_symbol', 'process_input')
+SLOW_STAGES = ('visualize_qr',)  # matplotlib, a few samples are enough
+BUDGET = 0.25      # seconds of samples per stage and case
+MIN_SAMPLES = 5
+MAX_SAMPLES = 2000
+TOLERANCE = 0.15   # p50 this much slower than the baseline counts as a regression
+IMPORT_BUDGET = 0.3  # seconds for a cold 'import basic', numpy is most of it
+LAZY_MODULES = ('matplotlib', 'PIL')  # must not be loaded until a renderer needs them
+
+def unmasked_grid(text, ecc_level='L'):
+    # data placed, not yet masked, same as process_input up to mask selection
+    data_codewords, V, ecc_level = basic.build_qr_payload(bytearray(text, 'utf-8'), ecc_level)
+    bits = basic.generate_error_corrected_codewords(data_codewords, V, ecc_level)
+    layout = basic.get_layout(V)
+    return basic.add_data(layout.grid.copy(), bits, layout)
+
+def legacy_mask_selection(grid):
+    # the old 4 penalties x 8 masks loop, each on a fresh copy
+    scores = []
+    for m in range(8):
+        masked = basic.apply_mask_pattern(copy.deepcopy(grid), m)
+        scores.append(basic.penalty_1(masked) + basic.penalty_2(masked) + basic.penalty_3(masked) + basic.penalty_4(masked))
+    return scores.index(min(scores))
+
+def time_per_call(fn, repeat=5):
+    number, _ = timeit.Timer(fn).autorange()
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+def bench_masks():
+    for text in ['hello world', 'https://example.com/abc']:
+        grid = unmasked_grid(text)
+        reserved = basic.get_layout((len(grid) - 17) // 4).reserved
+        legacy = time_per_call(lambda: legacy_mask_selection(grid.tolist()))
+        engine = time_per_call(lambda: select_mask(grid, reserved))
+        print(f"mask selection  size={len(grid):3d}  legacy {legacy * 1e3:8.3f} ms  engine {engine * 1e3:8.3f} ms  x{legacy / engine:.0f}")
+
+def cold_import(module='basic'):
+    # seconds to import module in a fresh interpreter, and which lazy modules it pulled in
+    code = ('import sys, time; t = time.perf_counter(); import %s; '
+            'print(time.perf_counter() - t); print(*[m for m in %r if m in sys.modules])' % (module, LAZY_MODULES))
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+    return float(out[0]), out[1].split() if len(out) > 1 else []
+
+def bench_imports(budget=IMPORT_BUDGET, runs=3):
+    # best of a few runs, so a busy disk cache doesn't fail it
+    seconds, loaded = min(cold_import() for _ in range(runs))
+    print(f"import basic  {seconds * 1e3:7.1f} ms  budget {budget * 1e3:.0f} ms  eager: {' '.join(loaded) or 'none'}")
+    return seconds <= budget and not loaded
+
+FUZZ_ALPHABETS = ('0123456789', '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:',
+                  'abcdefghijklmnopqrstuvwxyz0123456789:/.?=&-', '漢字日本語テスト', 'é漢a1B:😀 ')
+
+## (text, level, mask, version, sha256 of np.packbits(modules)) of symbols made with segno; the
+## first is the worked example in ISO/IEC 18004 annex I. Round trips can't catch a mistake the
+## encoder and reader share (block table, RS arithmetic, segment modes), these can.
+KNOWN_ANSWERS = (
+    ('01234567', 'M', 2, 1, '8d83adcf247435c004fe4ac8310cae18e0ad30203fd8f3df4a71fce45e4f8edd'),
+    (('abcdefghijklmnopqrstuvwxyz' * 3)[:64], 'H', 5, 7,
+     '870d3c9dd62951ca5e30f50961074f15cf231cae70c9d216a6cb7dcfa8c64270'),
+    (('HTTPS://EXAMPLE.COM/ORDERS/ABCDEFGHIJKLMNOPQRSTUVWXYZ-$%*+./: ' * 10)[:602], 'Q', 3, 19,
+     '8c8406e37ac4da0d2f16e6d604d448a583b0b56b8dced9f2c00103b658a71405'),
+    (('abcdefghijklmnopqrstuvwxyz' * 114)[:2953], 'L', 6, 40,
+     '235ea486af825d8a5d54b731433474568bcf4d9be14ee5b676d05f79ff8fbcb7'),
+)
+
+def known_answers():
+    # [(case, error)] for every reference symbol the encoder doesn't reproduce or the reader can't read
+    failures = []
+    for text, ecc_level, mask, V, digest in KNOWN_ANSWERS:
+        case = '%d-%s mask %d' % (V, ecc_level, mask)
+        grid, layout, _ = basic.encode_symbol(text, basic.EncodeOptions(ecc_level, mask=mask))
+        if layout.version != V or hashlib.sha256(np.packbits(grid.modules).tobytes()).hexdigest() != digest:
+            failures.append((case, 'encoder output differs from the reference'))
+            continue
+        try:
+            verify_symbol(grid, text)
+        except SymbolError as e:
+            failures.append((case, str(e)))
+    print(f"known  {len(KNOWN_ANSWERS)} reference symbols  {len(failures)} failed")
+    return failures
+
+def fuzz(count=1000, seed=0):
+    # round trip through the matrix reader, [(text, options, error)] for every symbol that doesn't read back
+    rng = random.Random(seed)
+    failures = []
+    start = time.perf_counter()
+    done = 0
+    for _ in range(count):
+        alphabet = ''.join(rng.sample(FUZZ_ALPHABETS, rng.randint(1, 2)))
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, rng.choice((20, 200, 3000)))))
+        if rng.random() < 0.2:
+            text = rng.randbytes(len(text))  # bytes input, one byte mode segment
+        options = basic.EncodeOptions(rng.choice('LMQH'), rng.random() < 0.2, mask=rng.choice((None,) + tuple(range(8))))
+        try:
+            grid, layout, _ = basic.encode_symbol(text, options)
+        except basic.DataTooLong:
+            continue
+        try:
+            verify_symbol(grid, text, layout.logo_area)
+        except SymbolError as e:
+            failures.append((text, options, str(e)))
+        done += 1
+    seconds = time.perf_counter() - start
+    print(f"fuzz  {done} symbols  {len(failures)} failed  {done / seconds:.0f} encode+verify/s")
+    return failures
+
+def payload_for(V, ecc_level):
+    # lowercase text (byte mode) that just fills version V at this level
+    count_bits = 8 if V < 10 else 16
+    length = (DATA_CAPACITY_BITS[ecc_level][V - 1] - 4 - count_bits) // 8
+    return ('abcdefghijklmnopqrstuvwxyz' * (length // 26 + 1))[:length]
+
+def stage_calls(text, ecc_level):
+    # one zero-argument call per stage, each fed the previous stage's real output
+    data_codewords, V, ecc_level = basic.build_qr_payload(text, ecc_level)
+    codewords = basic.generate_error_corrected_codewords(data_codewords, V, ecc_level)
+    layout = basic.get_layout(V)
+    grid = basic.add_data(layout.grid.copy(), codewords, layout)
+    mask, masked = select_mask(grid, layout.reserved)
+    final = basic.QRMatrix(modules=masked)
+    basic.place_format_bits(final, basic.get_format_bits(ecc_level, mask))
+    calls = {
+        'build_qr_payload': lambda: basic.build_qr_payload(text, ecc_level),
+        'generate_error_corrected_codewords': lambda: basic.generate_error_corrected_codewords(data_codewords, V, ecc_level),
+        'add_data': lambda: basic.add_data(layout.grid.copy(), codewords, layout),
+        'select_mask': lambda: select_mask(grid, layout.reserved),
+        'get_format_bits': lambda: basic.get_format_bits(ecc_level, mask),
+        'render_png': lambda: render_png(final),
+        'render_svg': lambda: render_svg(final),
+        'write_raster': lambda: write_raster(final, bytearray()),
+        'visualize_qr': lambda: basic.visualize_qr(final, ecc_level, basic.DEFAULT_LOGO),
+        'read_symbol': lambda: read_symbol(final),
+        'process_input': lambda: basic.process_input(text, ecc_level),
+    }
+    return V, calls
+
+def sample(fn, budget=BUDGET):
+    # per-call times in seconds, as many as fit in the budget
+    times = []
+    deadline = time.perf_counter() + budget
+    while len(times) < MAX_SAMPLES and (len(times) < MIN_SAMPLES or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+def percentile(sorted_times, p):
+    return sorted_times[round(p / 100 * (len(sorted_times) - 1))]
+
+def summarize(times):
+    times = sorted(times)
+    return {'samples': len(times), 'ops_per_sec': len(times) / sum(times),
+            'p50_us': percentile(times, 50) * 1e6, 'p99_us': percentile(times, 99) * 1e6}
+
+def run_suite(versions=VERSIONS, ecc_levels=ECC_LEVELS, stages=STAGES, budget=BUDGET):
+    # {'stage|ecc|V': summary}
+    results = {}
+    for ecc_level in ecc_levels:
+        for target in versions:
+            V, calls = stage_calls(payload_for(target, ecc_level), ecc_level)
+            for stage in stages:
+                calls[stage]()  # warm caches, first call isn't what we're measuring
+                times = sample(calls[stage], budget / 10 if stage in SLOW_STAGES else budget)
+                results['%s|%s|%d' % (stage, ecc_level, V)] = summarize(times)
+            for stage in stages:
+                print_row('%s|%s|%d' % (stage, ecc_level, V), results['%s|%s|%d' % (stage, ecc_level, V)])
+    return results
+
+def print_row(key, summary, baseline=None):
+    stage, ecc_level, V = key.split('|')
+    line = (f"{stage:36s} {ecc_level} V{V:>2s}  n={summary['samples']:5d}  {summary['ops_per_sec']:11.1f} ops/s"
+            f"  p50 {summary['p50_us']:10.1f} us  p99 {summary['p99_us']:10.1f} us")
+    if baseline is not None:
+        line += f"  x{summary['p50_us'] / baseline['p50_us']:.2f}"
+    print(line)
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # keys whose p50 is more than tolerance slower than the baseline
+    regressions = []
+    for key, summary in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        print_row(key, summary, base)
+        if summary['p50_us'] > base['p50_us'] * (1 + tolerance):
+            regressions.append(key)
+    return regressions
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-stage timings of the encoder.')
+    parser.add_argument('suite', nargs='?', choices=['stages', 'masks', 'imports', 'fuzz', 'known'], default='stages')
+    parser.add_argument('--save', metavar='JSON', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='JSON', help='compare against a saved baseline, exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--quick', action='store_true', help='versions %s only, shorter budget' % (QUICK_VERSIONS,))
+    parser.add_argument('--stage', action='append', choices=STAGES, help='only these stages (repeatable)')
+    parser.add_argument('--count', type=int, default=1000, help='fuzz: symbols to try')
+    parser.add_argument('--seed', type=int, default=0, help='fuzz: random seed')
+    args = parser.parse_args(argv)
+
+    if args.suite == 'masks':
+        bench_masks()
+        return 0
+    if args.suite == 'imports':
+        return 0 if bench_imports() else 1
+    if args.suite == 'known':
+        failures = known_answers()
+        for case, error in failures:
+            print('failed:', case, error)
+        return 1 if failures else 0
+    if args.suite == 'fuzz':
+        # a round trip only means something once the reference symbols still match
+        if known_answers():
+            return 1
+        failures = fuzz(args.count, args.seed)
+        for text, options, error in failures[:20]:
+            print('failed:', error, options, repr(text[:60]))
+        return 1 if failures else 0
+
+    versions = QUICK_VERSIONS if args.quick else VERSIONS
+    results = run_suite(versions, stages=args.stage or STAGES, budget=BUDGET / 5 if args.quick else BUDGET)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('\ncompared with', args.compare, baseline['environment']['time'])
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for key in regressions:
+            print('slower:', key)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
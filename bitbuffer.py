@@ -0,0 +1,38 @@
+## growable bit string backed by a single int, most significant bit first
+
+PAD_BYTES = b'\xec\x11'  # 11101100 00010001
+
+class BitBuffer:
+    __slots__ = ('value', 'length')
+
+    def __init__(self):
+        self.value = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return format(self.value, '0%db' % self.length) if self.length else ''
+
+    def append_bits(self, value, n):
+        # low n bits of value
+        self.value = (self.value << n) | (value & ((1 << n) - 1))
+        self.length += n
+
+    def append_bytes(self, data):
+        self.value = (self.value << (8 * len(data))) | int.from_bytes(data, 'big')
+        self.length += 8 * len(data)
+
+    def pad_to(self, capacity):
+        # terminator if room, zeros to the byte boundary, then alternating pad bytes
+        self.append_bits(0, max(0, min(4, capacity - self.length)))
+        self.append_bits(0, -self.length % 8)
+        missing = (capacity - self.length) // 8
+        if missing > 0:
+            self.append_bytes((PAD_BYTES * (missing // 2 + 1))[:missing])
+
+    def to_bytes(self):
+        # pads the last byte with zeros if the length isn't a multiple of 8
+        n = (self.length + 7) // 8
+        return (self.value << (n * 8 - self.length)).to_bytes(n, 'big')
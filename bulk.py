@@ -0,0 +1,235 @@
+## bulk generation from CSV / JSONL, rows are streamed so memory stays flat however long the input is
+# python bulk.py labels.csv --out images/
+# python bulk.py labels.jsonl --column url --name-column sku --renderer svg --out labels.zip
+# cat labels.csv | python bulk.py - --out - > labels.tar
+# python bulk.py labels.csv --renderer pbm --scale 8 --border 4 --out print/
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from basic import EncodeOptions, encode_symbol, image_bytes, write_symbol
+from batch import get_pool
+
+CHUNK_SIZE = 64        # rows per task sent to a worker
+CHUNKS_PER_WORKER = 2  # tasks in flight per worker before reading stops
+
+def read_rows(path, fmt='auto', column=None, name_column=None, skipped=None):
+    # yields (name, text) one row at a time; the numbers of rows that had no usable text
+    # are appended to skipped, if given
+    if fmt == 'auto':
+        fmt = 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+    if path == '-':
+        f = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    else:
+        f = open(path, encoding='utf-8', newline='')
+    shown = column if column is not None else 'text' if fmt == 'jsonl' else '0'
+    with f:
+        rows = _jsonl_rows(f, column, name_column) if fmt == 'jsonl' else _csv_rows(f, column, name_column)
+        for number, (name, text) in enumerate(rows):
+            if text is None or isinstance(text, ValueError):
+                # a ValueError stands in for a line that isn't JSON
+                print('row %d: %s, skipped' % (number, text or 'no text in column %r' % shown), file=sys.stderr)
+                if skipped is not None:
+                    skipped.append(number)
+                continue
+            yield safe_name(name) if name else '%08d' % number, text
+
+def _csv_rows(f, column, name_column):
+    # a numeric column (or none) means there is no header row
+    if column is None or column.isdigit():
+        index = int(column or 0)
+        name_index = int(name_column) if name_column else None
+        for row in csv.reader(f):
+            yield (row[name_index] if name_index is not None and name_index < len(row) else None,
+                   row[index] if index < len(row) else None)
+    else:
+        for row in csv.DictReader(f):
+            yield row.get(name_column) if name_column else None, row.get(column)
+
+def _json_text(value):
+    # numbers and booleans as they're written in JSON, None for null, lists and objects
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return json.dumps(value)
+    return None
+
+def _jsonl_rows(f, column, name_column):
+    # each line is an object, or a bare JSON value
+    column = column or 'text'
+    for line_number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield None, ValueError('line %d is not JSON (%s)' % (line_number, e))
+            continue
+        if not isinstance(row, dict):
+            yield None, _json_text(row)
+            continue
+        name = row.get(name_column) if name_column else None
+        yield None if name is None else str(name), _json_text(row.get(column))
+
+def safe_name(name):
+    return re.sub(r'[^\w.-]', '_', name)[:200]
+
+def _chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def render_chunk(rows, ecc_level='H', renderer='png', raster=None):
+    # [(name, image bytes or None, error or None)], a bad row doesn't stop the rest;
+    # raster=(scale, border, dpi) renders png / pbm / pgm at exactly that size
+    options = EncodeOptions(ecc_level, renderer=renderer)
+    results = []
+    for name, text in rows:
+        try:
+            grid, layout, level = encode_symbol(text, options)
+            if raster:
+                image = bytearray()
+                write_symbol(grid, layout, image, renderer, *raster)
+                results.append((name, bytes(image), None))
+            else:
+                results.append((name, image_bytes(grid, layout, level, options), None))
+        except ValueError as e:
+            results.append((name, None, str(e)))
+    return results
+
+class DirectoryWriter:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, name, data):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+class TarWriter:
+    # 'w|' writes straight through, so the output can be a pipe
+    def __init__(self, fileobj, owned=False):
+        self.tar = tarfile.open(fileobj=fileobj, mode='w|')
+        self.fileobj = fileobj if owned else None
+        self.mtime = time.time()
+
+    def write(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self.mtime
+        self.tar.addfile(info, io.BytesIO(data))
+        self.tar.members.clear()  # tarfile keeps every TarInfo otherwise, memory would grow per row
+
+    def close(self):
+        self.tar.close()
+        if self.fileobj:
+            self.fileobj.close()
+
+class ZipWriter:
+    # the central directory is written at the end, so memory grows with the row count
+    # (about 100 bytes an image); use a .tar or a directory for millions of rows
+    def __init__(self, fileobj, owned=False):
+        self.zip = zipfile.ZipFile(fileobj, 'w')
+        self.fileobj = fileobj if owned else None
+
+    def write(self, name, data):
+        # PNG is already deflated, SVG text isn't
+        compress = zipfile.ZIP_STORED if name.endswith('.png') else zipfile.ZIP_DEFLATED
+        self.zip.writestr(name, data, compress_type=compress)
+
+    def close(self):
+        self.zip.close()
+        if self.fileobj:
+            self.fileobj.close()
+
+def open_writer(out):
+    # '-' is a tar stream on stdout, *.tar / *.zip are archives, anything else a directory
+    if out == '-':
+        return TarWriter(sys.stdout.buffer)
+    if out.endswith('.tar'):
+        return TarWriter(open(out, 'wb'), owned=True)
+    if out.endswith('.zip'):
+        return ZipWriter(open(out, 'wb'), owned=True)
+    return DirectoryWriter(out)
+
+def generate(rows, writer, ecc_level='H', renderer='png', workers=None, chunk_size=CHUNK_SIZE, raster=None):
+    # images are written as chunks finish, in completion order; once workers * CHUNKS_PER_WORKER
+    # chunks are pending no more rows are read until one is done
+    workers = workers or os.cpu_count()
+    written = failed = 0
+
+    def drain(results):
+        nonlocal written, failed
+        for name, image, error in results:
+            if image is None:
+                failed += 1
+                print('%s: %s' % (name, error), file=sys.stderr)
+            else:
+                writer.write('%s.%s' % (name, renderer), image)
+                written += 1
+
+    if workers == 1:
+        for chunk in _chunked(rows, chunk_size):
+            drain(render_chunk(chunk, ecc_level, renderer, raster))
+        return written, failed
+
+    pool = get_pool(workers)
+    pending = set()
+    for chunk in _chunked(rows, chunk_size):
+        if len(pending) >= workers * CHUNKS_PER_WORKER:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                drain(future.result())
+        pending.add(pool.submit(render_chunk, chunk, ecc_level, renderer, raster))
+    for future in wait(pending).done:
+        drain(future.result())
+    return written, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a QR code for every row of a CSV or JSONL file.')
+    parser.add_argument('input', help="CSV or JSONL file, '-' for stdin")
+    parser.add_argument('--out', required=True, help="directory, .tar or .zip file, '-' for a tar stream on stdout "
+                        "(.zip keeps an entry per image in memory, prefer .tar or a directory for very large runs)")
+    parser.add_argument('--format', choices=['auto', 'csv', 'jsonl'], default='auto')
+    parser.add_argument('--column', help="text column: CSV header name or 0-based index (default 0), JSONL key (default 'text')")
+    parser.add_argument('--name-column', help='column used for file names (default: row number)')
+    parser.add_argument('--ecc', choices=['L', 'M', 'Q', 'H'], default='H')
+    parser.add_argument('--renderer', choices=['png', 'svg', 'pbm', 'pgm'], default='png')
+    parser.add_argument('--scale', type=int, default=10, help='pixels per module (png, pbm, pgm)')
+    parser.add_argument('--border', type=int, default=4, help='quiet zone in modules (png, pbm, pgm)')
+    parser.add_argument('--dpi', type=int, default=None, help='resolution stored in the PNG')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core, 1 = no pool)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    skipped = []
+    rows = read_rows(args.input, args.format, args.column, args.name_column, skipped)
+    writer = open_writer(args.out)
+    try:
+        raster = None if args.renderer == 'svg' else (args.scale, args.border, args.dpi)
+        written, failed = generate(rows, writer, args.ecc, args.renderer, args.workers, args.chunk_size, raster)
+    finally:
+        writer.close()
+    print('%d images, %d failed, %d skipped, %.1f s' % (written, failed, len(skipped), time.perf_counter() - started),
+          file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
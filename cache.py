@@ -0,0 +1,117 @@
+## content-addressed cache for finished images, stored as raw PNG / SVG bytes
+import base64
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from basic import encode_image
+
+def cache_key(text, ecc_level='H', logo=False, renderer='png'):
+    # everything that changes the output goes into the hash
+    options = json.dumps([text, ecc_level, bool(logo), renderer], ensure_ascii=False)
+    return hashlib.sha256(options.encode('utf-8')).hexdigest()
+
+class ResultCache:
+    # LRU bounded by total stored bytes, optionally written through to spill_dir
+    def __init__(self, max_bytes=64 * 1024 * 1024, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        value = self._read_spill(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+        self._write_spill(key, value)
+
+    def _store(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.current_bytes -= len(old)
+        self._entries[key] = value
+        self.current_bytes += len(value)
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted)
+            self.evictions += 1
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, key)
+
+    def _read_spill(self, key):
+        if not self.spill_dir:
+            return None
+        try:
+            with open(self._spill_path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_spill(self, key, value):
+        if not self.spill_dir or os.path.exists(self._spill_path(key)):
+            return
+        # write then rename so readers never see half a file
+        fd, tmp = tempfile.mkstemp(dir=self.spill_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(tmp, self._spill_path(key))
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self.current_bytes, 'max_bytes': self.max_bytes}
+
+def content_etag(image):
+    # strong validator, changes whenever the bytes do
+    return hashlib.sha256(image).hexdigest()[:32]
+
+def cached_image(cache, data, ecc_level='H', logoBool=False, renderer='png'):
+    # raw image bytes, encoded and stored on a miss
+    key = cache_key(data, ecc_level, logoBool, renderer)
+    image = cache.get(key)
+    if image is None:
+        image = encode_image(data, ecc_level, logoBool, renderer)
+        cache.put(key, image)
+    return image
+
+def cached_gzip(cache, image, data, ecc_level='H', logoBool=False, renderer='svg'):
+    # gzipped copy of an image from cached_image, compressed once; mtime=0 keeps the header
+    # free of the time, so the bytes behind a strong ETag never change
+    key = cache_key(data, ecc_level, logoBool, renderer + '+gzip')
+    compressed = cache.get(key)
+    if compressed is None:
+        compressed = gzip.compress(image, 6, mtime=0)
+        cache.put(key, compressed)
+    return compressed
+
+def cached_process_input(cache, data, ecc_level='H', logoBool=False, renderer='png'):
+    # same result as process_input
+    return base64.b64encode(cached_image(cache, data, ecc_level, logoBool, renderer)).decode('ascii')
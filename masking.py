@@ -0,0 +1,125 @@
+import numpy as np
+
+_planes = {}  # size -> planes, shared.install can fill it from a mapped file
+
+def mask_planes(size):
+    # (8, size, size) bool array, True where mask m flips the module
+    planes = _planes.get(size)
+    if planes is None:
+        planes = _planes.setdefault(size, _build_planes(size))
+    return planes
+
+def _build_planes(size):
+    r, c = np.indices((size, size))
+    planes = np.stack([
+        (r + c) % 2 == 0,
+        r % 2 == 0,
+        c % 3 == 0,
+        (r + c) % 3 == 0,
+        ((r // 2) + (c // 3)) % 2 == 0,
+        ((r * c) % 2) + ((r * c) % 3) == 0,
+        (((r * c) % 2) + ((r * c) % 3)) % 2 == 0,
+        (((r + c) % 2) + ((r * c) % 3)) % 2 == 0,
+    ])
+    planes.setflags(write=False)
+    return planes
+
+_flips = {}
+
+def data_flips(reserved):
+    # mask planes limited to the data modules, built once per reserved map
+    # (layouts are cached, so the same map object comes back for every symbol)
+    entry = _flips.get(id(reserved))
+    if entry is None or entry[0] is not reserved:
+        if len(_flips) > 128:
+            _flips.clear()
+        flips = (mask_planes(len(reserved)) & ~reserved).view(np.uint8)
+        flips.setflags(write=False)
+        entry = _flips[id(reserved)] = (reserved, flips)
+    return entry[1]
+
+def apply_masks(grid, reserved):
+    # every candidate in one broadcast, data modules only
+    return np.asarray(grid, dtype=np.uint8) ^ data_flips(reserved)
+
+def _run_penalty(lines):
+    # lines: (k, n, n) candidates, scores runs of 5+ along the last axis
+    k, n, _ = lines.shape
+    # a sentinel column of 2s stops runs from crossing into the next line
+    padded = np.full((k, n, n + 1), 2, dtype=np.int8)
+    padded[:, :, :n] = lines
+    flat = padded.ravel()
+    starts = np.flatnonzero(np.diff(flat, prepend=-1))
+    lengths = np.diff(starts, append=flat.size)
+    long_runs = lengths >= 5
+    owner = starts[long_runs] // (n * (n + 1))
+    return np.bincount(owner, weights=lengths[long_runs] - 2, minlength=k).astype(np.int64)
+
+def penalty_runs(candidates):
+    k = len(candidates)
+    scores = _run_penalty(np.concatenate([candidates, candidates.transpose(0, 2, 1)]))
+    return scores[:k] + scores[k:]
+
+def penalty_blocks(candidates):
+    tl = candidates[:, :-1, :-1]
+    same = (tl == candidates[:, :-1, 1:]) & (tl == candidates[:, 1:, :-1]) & (tl == candidates[:, 1:, 1:])
+    return 3 * same.sum(axis=(1, 2))
+
+def penalty_finder_like(candidates):
+    k, n, _ = candidates.shape
+    # rows and columns together, light quiet zone past the edges counts towards the pattern
+    dark = np.zeros((2 * k, n, n + 8), dtype=bool)
+    dark[:k, :, 4:n + 4] = candidates
+    dark[k:, :, 4:n + 4] = candidates.transpose(0, 2, 1)
+    light = ~dark
+    m = n + 2
+    # 1:1:3:1:1 core starting at each position
+    core = (dark[:, :, 0:m] & light[:, :, 1:m + 1] & dark[:, :, 2:m + 2] & dark[:, :, 3:m + 3]
+            & dark[:, :, 4:m + 4] & light[:, :, 5:m + 5] & dark[:, :, 6:m + 6])
+    # 4 light modules starting at each position
+    gap = light[:, :, 0:m + 3] & light[:, :, 1:m + 4] & light[:, :, 2:m + 5] & light[:, :, 3:m + 6]
+    w = n - 2  # windows of 11 in the padded line
+    hits = (core[:, :, 0:w] & gap[:, :, 7:w + 7]).sum(axis=(1, 2)) + (gap[:, :, 0:w] & core[:, :, 4:w + 4]).sum(axis=(1, 2))
+    return 40 * (hits[:k] + hits[k:])
+
+def penalty_balance(candidates):
+    total = candidates.shape[1] * candidates.shape[2]
+    dark = candidates.sum(axis=(1, 2), dtype=np.int64)
+    # 10 points for each full 5% step away from 50% dark
+    return 10 * (np.abs(dark * 20 - total * 10) // total)
+
+def score_masks(candidates):
+    return (penalty_runs(candidates) + penalty_blocks(candidates)
+            + penalty_finder_like(candidates) + penalty_balance(candidates))
+
+EARLY_EXIT_STEP = 4  # candidates fully scored per round
+EARLY_EXIT_MIN_SIZE = 45  # below V7 one round of all 8 is cheaper than pruning
+
+def check_mask(mask):
+    # None (pick the best) or one of the 8 patterns
+    if mask is not None and not (isinstance(mask, (int, np.integer)) and 0 <= mask <= 7):
+        raise ValueError('mask must be a pattern number 0 - 7 or None, not %r' % (mask,))
+
+def select_mask(grid, reserved, mask=None):
+    check_mask(mask)
+    grid = np.asarray(grid, dtype=np.uint8)
+    flips = data_flips(reserved)
+    if mask is not None:
+        return mask, grid ^ flips[mask]  # fixed mask, nothing to score
+
+    candidates = grid ^ flips
+    # the cheap rules for all 8 are a lower bound on each total
+    bounds = penalty_blocks(candidates) + penalty_balance(candidates)
+    remaining = [int(m) for m in np.argsort(bounds, kind='stable')]
+    step = EARLY_EXIT_STEP if len(grid) >= EARLY_EXIT_MIN_SIZE else 8
+    best_mask, best_score = None, None
+    while remaining:
+        group, remaining = remaining[:step], remaining[step:]
+        scored = candidates[group]
+        totals = bounds[group] + penalty_runs(scored) + penalty_finder_like(scored)
+        for m, total in zip(group, totals):
+            if best_score is None or total < best_score or (total == best_score and m < best_mask):
+                best_mask, best_score = m, total  # lowest pattern number wins ties
+        # drop every mask whose lower bound can't beat the best so far
+        remaining = [m for m in remaining if bounds[m] < best_score or (bounds[m] == best_score and m < best_mask)]
+    return best_mask, candidates[best_mask]
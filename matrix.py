@@ -0,0 +1,56 @@
+## module grid as one contiguous uint8 array, 1 = dark
+import numpy as np
+
+class QRMatrix:
+    __slots__ = ('modules',)
+
+    def __init__(self, size=21, modules=None):
+        if modules is None:
+            modules = np.zeros((size, size), dtype=np.uint8)
+        self.modules = modules
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls(modules=np.array(rows, dtype=np.uint8))
+
+    @property
+    def size(self):
+        return self.modules.shape[0]
+
+    def __len__(self):
+        return self.modules.shape[0]
+
+    def __getitem__(self, index):
+        # grid[r] is a writable row view, so grid[r][c] = 1 works like it did on lists
+        return self.modules[index]
+
+    def __setitem__(self, index, value):
+        self.modules[index] = value
+
+    def __iter__(self):
+        return iter(self.modules)
+
+    def __eq__(self, other):
+        return isinstance(other, QRMatrix) and np.array_equal(self.modules, other.modules)
+
+    def __array__(self, dtype=None, copy=None):
+        # zero-copy for np.asarray(grid)
+        if dtype is None or dtype == self.modules.dtype:
+            return self.modules
+        return self.modules.astype(dtype)
+
+    def row(self, r):
+        return self.modules[r]
+
+    def column(self, c):
+        return self.modules[:, c]
+
+    def copy(self):
+        return QRMatrix(modules=self.modules.copy())
+
+    def freeze(self):
+        self.modules.setflags(write=False)
+        return self
+
+    def tolist(self):
+        return self.modules.tolist()
@@ -0,0 +1,111 @@
+## per-stage timings of each encode, nothing is measured unless a hook or collector is listening
+# add_hook(fn) calls fn(stage, seconds, nbytes) for every stage of every encode in this process,
+# collect() gathers the stages of the encodes run inside the with block on this thread
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)  # seconds
+
+_hooks = []
+_local = threading.local()
+
+def add_hook(fn):
+    _hooks.append(fn)
+
+def remove_hook(fn):
+    _hooks.remove(fn)
+
+class _Stage:
+    __slots__ = ('name', 'nbytes', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.nbytes = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        for hook in _hooks:
+            hook(self.name, seconds, self.nbytes)
+        for collected in getattr(_local, 'collectors', ()):
+            collected.append((self.name, seconds, self.nbytes))
+        return False
+
+class _Unmeasured:
+    # stand-in when nobody listens, setting nbytes on it does nothing
+    __slots__ = ()
+    nbytes = property(lambda self: 0, lambda self, value: None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_UNMEASURED = _Unmeasured()
+
+def stage(name):
+    # with stage('mask') as s: ...; s.nbytes = len(output)
+    if _hooks or getattr(_local, 'collectors', None):
+        return _Stage(name)
+    return _UNMEASURED
+
+@contextmanager
+def collect():
+    # with collect() as stages: process_input(...)  ->  [(stage, seconds, nbytes), ...]
+    collected = []
+    collectors = getattr(_local, 'collectors', None)
+    if collectors is None:
+        collectors = _local.collectors = []
+    collectors.append(collected)
+    try:
+        yield collected
+    finally:
+        collectors.remove(collected)
+
+class StageMetrics:
+    # histogram of seconds and a byte counter per stage, thread safe, add_hook(metrics.record)
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, nbytes):
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            entry = self._stages.get(name)
+            if entry is None:
+                entry = self._stages[name] = {'counts': [0] * (len(self.buckets) + 1), 'seconds': 0.0, 'bytes': 0}
+            entry['counts'][i] += 1
+            entry['seconds'] += seconds
+            entry['bytes'] += nbytes
+
+    def snapshot(self):
+        with self._lock:
+            return {name: {'counts': list(entry['counts']), 'seconds': entry['seconds'], 'bytes': entry['bytes']}
+                    for name, entry in self._stages.items()}
+
+    def prometheus(self, gauges=None):
+        # text exposition format, gauges is an optional {name: value} of extra numbers
+        stages = self.snapshot()
+        lines = ['# HELP qr_stage_seconds Time spent in each encode stage.',
+                 '# TYPE qr_stage_seconds histogram']
+        for name, entry in sorted(stages.items()):
+            total = 0
+            for le, count in zip(self.buckets + ('+Inf',), entry['counts']):
+                total += count
+                lines.append('qr_stage_seconds_bucket{stage="%s",le="%s"} %d' % (name, le, total))
+            lines.append('qr_stage_seconds_sum{stage="%s"} %.9f' % (name, entry['seconds']))
+            lines.append('qr_stage_seconds_count{stage="%s"} %d' % (name, total))
+        lines += ['# HELP qr_stage_bytes_total Bytes produced by each encode stage.',
+                  '# TYPE qr_stage_bytes_total counter']
+        for name, entry in sorted(stages.items()):
+            lines.append('qr_stage_bytes_total{stage="%s"} %d' % (name, entry['bytes']))
+        for name, value in sorted((gauges or {}).items()):
+            lines += ['# TYPE %s gauge' % name, '%s %s' % (name, value)]
+        return '\n'.join(lines) + '\n'
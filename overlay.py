@@ -0,0 +1,78 @@
+## centre logo, decoded once per file and pre-scaled once per (version, module scale)
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from render import png_bytes
+
+DEFAULT_LOGO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_image.png')
+MAX_SCALED_LOGOS = 32
+
+_decoded = {}            # path -> (mtime, RGBA array)
+_scaled = OrderedDict()  # (path, mtime, version, scale) -> RGB array, least recently used first
+_lock = threading.Lock()
+
+def load_logo(path=DEFAULT_LOGO):
+    # reloaded only when the file changes on disk
+    mtime = os.stat(path).st_mtime_ns
+    entry = _decoded.get(path)
+    if entry is None or entry[0] != mtime:
+        from PIL import Image  # only needed once a logo is actually drawn
+        with Image.open(path) as image:
+            pixels = np.asarray(image.convert('RGBA'))
+        entry = _decoded[path] = (mtime, pixels)
+    return entry
+
+def scaled_logo(path, V, scale, side):
+    # logo flattened onto white and centred in a square of side * scale pixels
+    mtime, pixels = load_logo(path)
+    key = (path, mtime, V, scale)
+    with _lock:
+        logo = _scaled.get(key)
+        if logo is not None:
+            _scaled.move_to_end(key)
+            return logo
+
+    from PIL import Image
+    box = side * scale
+    h, w = pixels.shape[:2]
+    fit = box / max(h, w)
+    resized = Image.fromarray(pixels).resize((max(1, round(w * fit)), max(1, round(h * fit))), Image.LANCZOS)
+    rgba = np.asarray(resized).astype(np.float32)
+    alpha = rgba[:, :, 3:] / 255
+    rgb = (rgba[:, :, :3] * alpha + 255 * (1 - alpha) + 0.5).astype(np.uint8)
+
+    logo = np.full((box, box, 3), 255, dtype=np.uint8)
+    y = (box - rgb.shape[0]) // 2
+    x = (box - rgb.shape[1]) // 2
+    logo[y:y + rgb.shape[0], x:x + rgb.shape[1]] = rgb
+    logo.setflags(write=False)
+
+    with _lock:
+        _scaled[key] = logo
+        while len(_scaled) > MAX_SCALED_LOGOS:
+            _scaled.popitem(last=False)
+    return logo
+
+def composite_logo(pixels, area, scale=10, border=4, path=DEFAULT_LOGO):
+    # one blit over the logo area, pixels is the (h, w, 3) rendered bitmap
+    start, stop = area
+    size = pixels.shape[0] // scale - 2 * border
+    logo = scaled_logo(path, (size - 17) // 4, scale, stop - start)
+    top = (start + border) * scale
+    pixels[top:top + logo.shape[0], top:top + logo.shape[1]] = logo
+    return pixels
+
+def render_png_with_logo(grid, area, scale=10, border=4, path=DEFAULT_LOGO):
+    light = np.pad((1 - np.asarray(grid, dtype=np.uint8)) * 255, border, constant_values=255)
+    light = light.repeat(scale, axis=0).repeat(scale, axis=1)
+    return rgb_png(composite_logo(np.repeat(light[:, :, None], 3, axis=2), area, scale, border, path))
+
+def rgb_png(pixels):
+    # (h, w, 3) uint8 bitmap -> 8-bit RGB PNG
+    height, width = pixels.shape[:2]
+    scanlines = np.zeros((height, width * 3 + 1), dtype=np.uint8)  # filter byte 0 on every row
+    scanlines[:, 1:] = pixels.reshape(height, width * 3)
+    return png_bytes(width, height, scanlines.tobytes(), color_type=2, bit_depth=8)
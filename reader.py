@@ -0,0 +1,310 @@
+## reads a finished module matrix back, no camera image involved: format info, function patterns,
+## unmask, zig-zag path, Reed-Solomon check / correction, then the segments.
+## Function patterns, the data path, format / version words, alignment positions, mask patterns
+## and the codeword count are worked out here from the spec, not taken from basic, tables.py or
+## masking.py. Shared with the encoder: the per-level block table (ECC_CODEWORDS_PER_BLOCK and
+## block_lengths), the GF(256) arithmetic in rs.py and the mode definitions in segments.py;
+## bench.py known checks those against symbols from another encoder.
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from rs import rs_correct, rs_syndromes_batch
+from segments import ALPHANUMERIC_CHARS, MODES, STRUCTURED_APPEND, version_class
+from tables import ECC_CODEWORDS_PER_BLOCK, MAX_VERSION, block_lengths
+
+Decoded = namedtuple('Decoded', ['text', 'version', 'ecc_level', 'mask', 'segments', 'corrected', 'format_errors'])
+
+class SymbolError(ValueError):
+    # the matrix isn't a valid symbol, or doesn't hold what it should
+    pass
+
+def _bch_word(data, generator):
+    # data followed by the remainder of data * x^degree divided by the generator polynomial
+    degree = generator.bit_length() - 1
+    remainder = data << degree
+    while remainder.bit_length() > degree:
+        remainder ^= generator << (remainder.bit_length() - 1 - degree)
+    return (data << degree) | remainder
+
+# 15 bit format words, level bits L 01, M 00, Q 11, H 10, then the mask, BCH(15, 5), xor 101010000010010
+FORMAT_WORDS = {(ecc_level, mask): _bch_word(bits << 3 | mask, 0b10100110111) ^ 0b101010000010010
+                for ecc_level, bits in (('L', 1), ('M', 0), ('Q', 3), ('H', 2)) for mask in range(8)}
+# 18 bit version words, BCH(18, 6), V7 and up
+VERSION_WORDS = {V: _bch_word(V, 0b1111100100101) for V in range(7, MAX_VERSION + 1)}
+
+def alignment_positions(V):
+    # row / column centres: 6, then evenly spaced (even steps) back from size - 7
+    if V == 1:
+        return ()
+    count = V // 7 + 2
+    step = 26 if V == 32 else (V * 4 + count * 2 + 1) // (count * 2 - 2) * 2
+    return (6,) + tuple(4 * V + 10 - i * step for i in range(count - 2, -1, -1))
+
+MASK_CONDITIONS = (
+    lambda r, c: (r + c) % 2 == 0,
+    lambda r, c: r % 2 == 0,
+    lambda r, c: c % 3 == 0,
+    lambda r, c: (r + c) % 3 == 0,
+    lambda r, c: (r // 2 + c // 3) % 2 == 0,
+    lambda r, c: r * c % 2 + r * c % 3 == 0,
+    lambda r, c: (r * c % 2 + r * c % 3) % 2 == 0,
+    lambda r, c: ((r + c) % 2 + r * c % 3) % 2 == 0,
+)
+
+@lru_cache(maxsize=None)
+def mask_plane(size, mask):
+    # 1 where the mask flips a module
+    r, c = np.indices((size, size))
+    plane = MASK_CONDITIONS[mask](r, c).astype(np.uint8)
+    plane.setflags(write=False)
+    return plane
+
+def _format_coordinates(size):
+    # (row, col) of format bit 0 .. 14, first copy then second
+    first = [(i, 8) for i in range(6)] + [(7, 8), (8, 8), (8, 7)] + [(8, 14 - i) for i in range(9, 15)]
+    second = [(8, size - 1 - i) for i in range(8)] + [(size - 15 + i, 8) for i in range(8, 15)]
+    return first, second
+
+def _version_coordinates(size):
+    # (row, col) of version bit 0 .. 17, top right copy then bottom left
+    return ([(i // 3, size - 11 + i % 3) for i in range(18)],
+            [(size - 11 + i % 3, i // 3) for i in range(18)])
+
+@lru_cache(maxsize=None)
+def function_patterns(V):
+    # (function modules, expected colours, modules to compare): format areas are function
+    # modules but their colours are left to the format decode
+    size = 4 * V + 17
+    used = np.zeros((size, size), dtype=bool)
+    expected = np.zeros((size, size), dtype=np.uint8)
+
+    ring = np.maximum(np.abs(np.arange(-3, 4))[:, None], np.abs(np.arange(-3, 4))[None, :])
+    finder = (ring != 2).astype(np.uint8)  # dark rings at distance 0, 1 and 3 from the centre
+    for r, c in ((0, 0), (0, size - 7), (size - 7, 0)):
+        expected[r:r+7, c:c+7] = finder
+    used[:9, :9] = used[:9, size-8:] = used[size-8:, :9] = True  # finders, separators, format
+
+    expected[6, 8:size-8] = expected[8:size-8, 6] = (np.arange(8, size - 8) % 2 == 0)
+    used[6, :] = used[:, 6] = True
+
+    positions = alignment_positions(V)
+    ring = np.maximum(np.abs(np.arange(-2, 3))[:, None], np.abs(np.arange(-2, 3))[None, :])
+    for r in positions:
+        for c in positions:
+            if (r, c) in ((6, 6), (6, size - 7), (size - 7, 6)):
+                continue
+            expected[r-2:r+3, c-2:c+3] = (ring != 1)
+            used[r-2:r+3, c-2:c+3] = True
+
+    if V >= 7:
+        for coordinates in _version_coordinates(size):
+            for i, (r, c) in enumerate(coordinates):
+                expected[r, c] = (VERSION_WORDS[V] >> i) & 1
+                used[r, c] = True
+
+    expected[size - 8, 8] = 1  # dark module
+    checked = used.copy()
+    for coordinates in _format_coordinates(size):
+        for r, c in coordinates:
+            checked[r, c] = False
+    checked[size - 8, 8] = True
+    for array in (used, expected, checked):
+        array.setflags(write=False)
+    return used, expected, checked
+
+@lru_cache(maxsize=None)
+def data_path(V):
+    # rows and cols of the data modules in placement order
+    size = 4 * V + 17
+    used = function_patterns(V)[0]
+    rows, cols = [], []
+    upward = True
+    for right in range(size - 1, 0, -2):
+        if right <= 6:
+            right -= 1  # the vertical timing column is skipped
+        for i in range(size):
+            row = size - 1 - i if upward else i
+            for col in (right, right - 1):
+                if not used[row, col]:
+                    rows.append(row)
+                    cols.append(col)
+        upward = not upward
+    return np.array(rows), np.array(cols)
+
+@lru_cache(maxsize=None)
+def block_positions(V, ecc_level):
+    # for each block, where its data then ecc codewords sit in the interleaved sequence
+    lengths = block_lengths(V, ecc_level)
+    ecc_codewords = ECC_CODEWORDS_PER_BLOCK[ecc_level][V]
+    blocks = [[] for _ in lengths]
+    k = 0
+    for i in range(max(lengths)):
+        for b, length in enumerate(lengths):
+            if i < length:
+                blocks[b].append(k)
+                k += 1
+    for i in range(ecc_codewords):
+        for b in range(len(lengths)):
+            blocks[b].append(k)
+            k += 1
+    return tuple(np.array(block) for block in blocks)
+
+def _closest(word, candidates):
+    # (candidate key, bit distance) of the nearest valid word
+    return min(((key, bin(word ^ value).count('1')) for key, value in candidates), key=lambda item: item[1])
+
+def _read_word(m, coordinates):
+    return sum(int(m[r, c]) << i for i, (r, c) in enumerate(coordinates))
+
+def read_format(m):
+    # (ecc level, mask, bit errors): decoded from whichever copy is closer to a valid word,
+    # errors counts the wrong bits of both copies
+    words = [_read_word(m, coordinates) for coordinates in _format_coordinates(len(m))]
+    (ecc_level, mask), errors = min((_closest(word, FORMAT_WORDS.items()) for word in words), key=lambda item: item[1])
+    if errors > 3:
+        raise SymbolError('format information unreadable')
+    return ecc_level, mask, sum(bin(word ^ FORMAT_WORDS[(ecc_level, mask)]).count('1') for word in words)
+
+def read_version(m):
+    # version from the version information, V7 and up
+    size = len(m)
+    candidates = list(VERSION_WORDS.items())
+    V, errors = min((_closest(_read_word(m, coordinates), candidates) for coordinates in _version_coordinates(size)),
+                    key=lambda item: item[1])
+    if errors > 3:
+        raise SymbolError('version information unreadable')
+    return V
+
+class _BitReader:
+    __slots__ = ('value', 'remaining')
+
+    def __init__(self, data):
+        self.value = int.from_bytes(data, 'big')
+        self.remaining = len(data) * 8
+
+    def read(self, n):
+        if n > self.remaining:
+            raise SymbolError('segment runs past the end of the data')
+        self.remaining -= n
+        return (self.value >> self.remaining) & ((1 << n) - 1)
+
+def read_segments(data, V):
+    # [(mode name, str or bytes)] up to the terminator or the end of the data, a Structured
+    # Append header comes out as ('structured_append', (index, total, parity))
+    bits = _BitReader(data)
+    cls = version_class(V)
+    modes = {mode.indicator: mode for mode in MODES}
+    segments = []
+    while bits.remaining >= 4:
+        indicator = bits.read(4)
+        if indicator == 0:
+            break
+        if indicator == STRUCTURED_APPEND:
+            index, total, parity = bits.read(4), bits.read(4) + 1, bits.read(8)
+            segments.append(('structured_append', (index, total, parity)))
+            continue
+        mode = modes.get(indicator)
+        if mode is None:
+            raise SymbolError('unsupported mode indicator %s' % format(indicator, '04b'))
+        count = bits.read(mode.count_bits[cls])
+        if mode.name == 'numeric':
+            digits = []
+            for i in range(0, count, 3):
+                group = min(3, count - i)
+                digits.append('%0*d' % (group, bits.read((0, 4, 7, 10)[group])))
+            segments.append((mode.name, ''.join(digits)))
+        elif mode.name == 'alphanumeric':
+            chars = []
+            for _ in range(count // 2):
+                pair = bits.read(11)
+                chars += [ALPHANUMERIC_CHARS[pair // 45], ALPHANUMERIC_CHARS[pair % 45]]
+            if count % 2:
+                chars.append(ALPHANUMERIC_CHARS[bits.read(6)])
+            segments.append((mode.name, ''.join(chars)))
+        elif mode.name == 'byte':
+            segments.append((mode.name, bytes(bits.read(8) for _ in range(count))))
+        else:
+            encoded = bytearray()
+            for _ in range(count):
+                value = bits.read(13)
+                code = (value // 0xC0 << 8) + value % 0xC0
+                code += 0x8140 if code < 0x1F00 else 0xC140
+                encoded += code.to_bytes(2, 'big')
+            segments.append((mode.name, encoded.decode('shift_jis')))
+    return segments
+
+def segments_text(segments):
+    # byte mode runs are joined before decoding, a character may be split between two of them
+    text, pending = [], b''
+    for name, value in segments:
+        if name == 'byte':
+            pending += value
+            continue
+        if name == 'structured_append':
+            continue
+        if pending:
+            text.append(pending.decode('utf-8', errors='replace'))
+            pending = b''
+        text.append(value)
+    if pending:
+        text.append(pending.decode('utf-8', errors='replace'))
+    return ''.join(text)
+
+def segments_bytes(segments):
+    # the data as bytes, byte mode runs as they are and the other modes as UTF-8
+    return b''.join(value if name == 'byte' else value.encode('utf-8')
+                    for name, value in segments if name != 'structured_append')
+
+def read_symbol(grid, ignore=None):
+    # Decoded, or SymbolError; ignore=(start, stop) skips the pattern check in a centre square
+    m = np.asarray(grid, dtype=np.uint8)
+    size = m.shape[0]
+    V = (size - 17) // 4
+    if m.ndim != 2 or m.shape[1] != size or (size - 17) % 4 or not 1 <= V <= MAX_VERSION:
+        raise SymbolError('%r is not a symbol size' % (m.shape,))
+
+    used, expected, checked = function_patterns(V)
+    if ignore is not None:
+        checked = checked.copy()
+        start, stop = ignore
+        checked[start:stop, start:stop] = False
+    wrong = np.count_nonzero((m != expected) & checked)
+    if wrong:
+        raise SymbolError('%d function pattern modules are wrong' % wrong)
+    if V >= 7 and read_version(m) != V:
+        raise SymbolError('version information says %d, size says %d' % (read_version(m), V))
+
+    ecc_level, mask, format_errors = read_format(m)
+    rows, cols = data_path(V)
+    bits = m[rows, cols] ^ mask_plane(size, mask)[rows, cols]
+    codewords = np.packbits(bits[:len(bits) // 8 * 8]).tobytes()  # the last 0 - 7 modules are remainder bits
+
+    positions = block_positions(V, ecc_level)
+    ecc_codewords = ECC_CODEWORDS_PER_BLOCK[ecc_level][V]
+    blocks = [bytes(codewords[i] for i in block) for block in positions]
+    bad = rs_syndromes_batch(blocks, ecc_codewords).any(axis=1)
+    corrected = 0
+    data = bytearray()
+    for block, is_bad, length in zip(blocks, bad, block_lengths(V, ecc_level)):
+        if is_bad:
+            try:
+                block, errors = rs_correct(block, ecc_codewords)
+            except ValueError as e:
+                raise SymbolError(str(e)) from None
+            corrected += errors
+        data += block[:length]
+
+    segments = read_segments(bytes(data), V)
+    return Decoded(segments_text(segments), V, ecc_level, mask, segments, corrected, format_errors)
+
+def verify_symbol(grid, text, ignore=None):
+    # read grid back and make sure it says text (str or bytes); without a logo area nothing may need correcting
+    decoded = read_symbol(grid, ignore)
+    read = segments_bytes(decoded.segments) if isinstance(text, (bytes, bytearray)) else decoded.text
+    if read != text:
+        raise SymbolError('symbol reads %r, expected %r' % (read[:40], text[:40]))
+    if ignore is None and (decoded.corrected or decoded.format_errors):
+        raise SymbolError('%d codewords and %d format bits needed correcting' % (decoded.corrected, decoded.format_errors))
+    return decoded
@@ -0,0 +1,167 @@
+## matplotlib-free renderers, grid in, image bytes out (1 = dark module)
+import os
+import re
+import struct
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+RASTER_FORMATS = ('png', 'pbm', 'pgm')
+IDAT_SIZE = 64 * 1024  # compressed bytes per IDAT chunk when streaming
+LUMA = np.array([299, 587, 114], dtype=np.uint32)  # RGB -> gray, in thousandths
+_BIT_CHARS = bytes.maketrans(b'\x00\x01', b'01')
+
+@lru_cache(maxsize=None)
+def row_expansion(scale):
+    # byte of 8 modules -> 8 * scale pixel bits, one entry per possible byte
+    table = []
+    for byte in range(256):
+        pixels = 0
+        for i in range(7, -1, -1):
+            bit = (byte >> i) & 1
+            pixels = (pixels << scale) | (((1 << scale) - 1) if bit else 0)
+        table.append(pixels.to_bytes(scale, 'big'))
+    return table
+
+def _light_row_bytes(row, border):
+    # modules packed 8 to a byte, light = 1 as 1-bit grayscale wants it, quiet zone included
+    bits = b'\x00' * border + bytes(bytearray(row)) + b'\x00' * border
+    width = len(bits)
+    bits += b'\x00' * (-width % 8)
+    value = int(bits.translate(_BIT_CHARS), 2) ^ ((1 << len(bits)) - 1)
+    return value.to_bytes(len(bits) // 8, 'big')
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+def render_png(grid, scale=10, border=4):
+    # grid doesn't have to be square, a sheet of several symbols isn't
+    width = (len(grid[0]) + 2 * border) * scale
+    height = (len(grid) + 2 * border) * scale
+    row_length = (width + 7) // 8
+    expand = row_expansion(scale)
+
+    # each pixel row starts with its filter byte, repeats of a row use the Up filter
+    # so they are all zeros and compress to almost nothing
+    same = b'\x02' + b'\x00' * row_length
+    blank = b'\x00' + b'\xff' * row_length  # light quiet zone row
+    quiet_zone = ([blank] + [same] * (border * scale - 1)) if border else []
+    rows = list(quiet_zone)
+    for row in grid:
+        rows.append(b'\x00' + b''.join([expand[b] for b in _light_row_bytes(row, border)])[:row_length])
+        rows += [same] * (scale - 1)
+    rows += quiet_zone
+
+    return png_bytes(width, height, b''.join(rows))  # 1-bit grayscale
+
+def png_bytes(width, height, scanlines, color_type=0, bit_depth=1):
+    # scanlines: every row already prefixed with its filter byte
+    header = struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, 0)
+    return (PNG_SIGNATURE + _png_chunk(b'IHDR', header)
+            + _png_chunk(b'IDAT', zlib.compress(scanlines, 6))
+            + _png_chunk(b'IEND', b''))
+
+def render_svg(grid, scale=10, border=4):
+    # one path, each horizontal run of dark modules is a single rectangle
+    parts = []
+    for r, row in enumerate(grid):
+        for run in re.finditer(b'\x01+', bytes(bytearray(row))):
+            start, width = run.start(), run.end() - run.start()
+            parts.append('M%d %dh%dv1h-%dz' % (start + border, r + border, width, width))
+    width, height = len(grid[0]) + 2 * border, len(grid) + 2 * border
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d" shape-rendering="crispEdges">'
+            '<rect width="100%%" height="100%%" fill="#fff"/><path fill="#000" d="%s"/></svg>'
+            % (width * scale, height * scale, width, height, ''.join(parts))).encode('ascii')
+
+def _writer(out):
+    # write function and byte counter for a file object, a raw file descriptor or a bytearray
+    written = [0]
+    if isinstance(out, int):
+        def put(data):
+            view = memoryview(data)
+            while view:
+                view = view[os.write(out, view):]
+    elif isinstance(out, bytearray):
+        put = out.extend
+    else:
+        put = out.write
+
+    def write(data):
+        put(data)
+        written[0] += len(data)
+    return write, written
+
+def _pixel_rows(grid, scale, border, logo):
+    # (row, times) from top to bottom, a row is gray (0 dark, 255 light) or RGB when there's a logo;
+    # only the pixel rows through the logo differ inside a module row, the rest repeat
+    width = (len(grid[0]) + 2 * border) * scale
+    color = logo is not None
+    if color:
+        (start, stop), pixels = logo
+        top = left = (start + border) * scale
+
+    def widen(row):
+        return np.repeat(row[:, None], 3, axis=1) if color else row
+
+    blank = widen(np.full(width, 255, dtype=np.uint8))
+    if border:
+        yield blank, border * scale
+    light = np.full(len(grid[0]) + 2 * border, 255, dtype=np.uint8)
+    for r, modules in enumerate(grid):
+        light[border:len(light) - border] = (1 - np.asarray(modules, dtype=np.uint8)) * 255
+        row = widen(light.repeat(scale))
+        if color and start <= r < stop:
+            for y in range((r + border) * scale, (r + border + 1) * scale):
+                row[left:left + pixels.shape[1]] = pixels[y - top]
+                yield row, 1
+        else:
+            yield row, scale
+    if border:
+        yield blank, border * scale
+
+def _gray(row):
+    return row if row.ndim == 1 else (row @ LUMA // 1000).astype(np.uint8)
+
+def check_raster_format(fmt):
+    if fmt not in RASTER_FORMATS:
+        raise ValueError('unknown raster format %r, expected one of %s' % (fmt, ', '.join(RASTER_FORMATS)))
+
+def write_raster(grid, out, fmt='png', scale=10, border=4, dpi=None, logo=None):
+    # streams the image one module row at a time, returns the bytes written. fmt is png (1-bit,
+    # or 8-bit RGB with a logo), pbm or pgm; logo is (logo area, RGB pixels of side * scale square),
+    # drawn in gray for pgm and thresholded for pbm. dpi goes in the PNG pHYs chunk, netpbm has no field for it
+    check_raster_format(fmt)
+    write, written = _writer(out)
+    width = (len(grid[0]) + 2 * border) * scale
+    height = (len(grid) + 2 * border) * scale
+    rows = _pixel_rows(grid, scale, border, logo)
+
+    if fmt != 'png':
+        write(b'P4\n%d %d\n' % (width, height) if fmt == 'pbm' else b'P5\n%d %d\n255\n' % (width, height))
+        for row, times in rows:
+            gray = _gray(row)
+            line = np.packbits(gray < 128).tobytes() if fmt == 'pbm' else gray.tobytes()  # pbm: 1 = dark
+            for _ in range(times):
+                write(line)
+        return written[0]
+
+    color = logo is not None
+    write(PNG_SIGNATURE + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8 if color else 1,
+                                                          2 if color else 0, 0, 0, 0)))
+    if dpi:
+        per_metre = round(dpi / 0.0254)
+        write(_png_chunk(b'pHYs', struct.pack('>IIB', per_metre, per_metre, 1)))
+    compressor = zlib.compressobj(6)
+    pending = bytearray()
+    for row, times in rows:
+        data = row.tobytes() if color else np.packbits(row > 127).tobytes()  # 1-bit: light = 1
+        same = b'\x02' + b'\x00' * len(data)  # Up filter, a repeat is all zeros
+        pending += compressor.compress(b'\x00' + data + same * (times - 1))
+        if len(pending) >= IDAT_SIZE:
+            write(_png_chunk(b'IDAT', bytes(pending)))
+            pending.clear()
+    pending += compressor.flush()
+    write(_png_chunk(b'IDAT', bytes(pending)) + _png_chunk(b'IEND', b''))
+    return written[0]
@@ -0,0 +1,163 @@
+## Reed-Solomon error correction over GF(256), primitive polynomial 0x11d
+from functools import lru_cache
+
+import numpy as np
+
+# antilog table is doubled so EXP[LOG[a] + LOG[b]] never needs a modulo
+EXP = [0] * 512
+LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    EXP[_i] = _x
+    LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+for _i in range(255, 512):
+    EXP[_i] = EXP[_i - 255]
+
+def gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return EXP[LOG[a] + LOG[b]]
+
+@lru_cache(maxsize=None)
+def generator_poly(ecc_codewords):
+    # (x - a^0)(x - a^1)...(x - a^(n-1)), coefficients highest power first, leading 1 dropped
+    poly = [1]
+    for i in range(ecc_codewords):
+        poly = [c ^ gf_mul(p, EXP[i]) for c, p in zip(poly + [0], [0] + poly)]
+    return tuple(poly[1:])
+
+@lru_cache(maxsize=None)
+def _generator_logs(ecc_codewords):
+    return tuple(LOG[c] for c in generator_poly(ecc_codewords))
+
+_mul = None  # shared.install can set it from a mapped file
+
+def _mul_table():
+    # MUL[a, b] = a * b in GF(256)
+    global _mul
+    if _mul is None:
+        exp = np.array(EXP, dtype=np.uint8)
+        log = np.array(LOG, dtype=np.intp)
+        table = exp[log[:, None] + log[None, :]]
+        table[0, :] = 0
+        table[:, 0] = 0
+        table.setflags(write=False)
+        _mul = table
+    return _mul
+
+def rs_encode(data, ecc_codewords):
+    # remainder of data(x) * x^n divided by the generator, as bytes
+    gen = _generator_logs(ecc_codewords)
+    remainder = [0] * ecc_codewords
+    for byte in data:
+        factor = byte ^ remainder[0]
+        del remainder[0]
+        remainder.append(0)
+        if factor:
+            f = LOG[factor]
+            for i, g in enumerate(gen):
+                remainder[i] ^= EXP[f + g]
+    return bytes(remainder)
+
+def rs_encode_batch(blocks, ecc_codewords):
+    # same remainder for many blocks at once, one column of all blocks per step
+    # blocks may differ in length: leading zero codewords don't change the remainder
+    length = max(len(block) for block in blocks)
+    data = np.zeros((len(blocks), length), dtype=np.uint8)
+    for i, block in enumerate(blocks):
+        data[i, length - len(block):] = np.frombuffer(bytes(block), dtype=np.uint8)
+
+    mul = _mul_table()
+    gen = np.array(generator_poly(ecc_codewords), dtype=np.intp)
+    remainder = np.zeros((len(blocks), ecc_codewords + 1), dtype=np.uint8)
+    for j in range(length):
+        factor = data[:, j] ^ remainder[:, 0]
+        remainder[:, :-1] = remainder[:, 1:]
+        remainder[:, :-1] ^= mul[factor[:, None], gen[None, :]]
+    return [row.tobytes() for row in remainder[:, :-1]]
+
+def gf_inverse(a):
+    return EXP[255 - LOG[a]]
+
+def _poly_eval(poly, x):
+    # lowest power first
+    value = 0
+    for c in reversed(poly):
+        value = gf_mul(value, x) ^ c
+    return value
+
+def rs_syndromes(block, ecc_codewords):
+    # block(x) at a^0 .. a^(n-1), all zero when the block is intact
+    syndromes = []
+    for j in range(ecc_codewords):
+        s = 0
+        for c in block:
+            s = gf_mul(s, EXP[j]) ^ c
+        syndromes.append(s)
+    return syndromes
+
+def rs_syndromes_batch(blocks, ecc_codewords):
+    # (blocks, n) array of syndromes, same zero padding trick as rs_encode_batch
+    length = max(len(block) for block in blocks)
+    data = np.zeros((len(blocks), length), dtype=np.uint8)
+    for i, block in enumerate(blocks):
+        data[i, length - len(block):] = np.frombuffer(bytes(block), dtype=np.uint8)
+
+    mul = _mul_table()
+    roots = np.array(EXP[:ecc_codewords], dtype=np.intp)
+    syndromes = np.zeros((len(blocks), ecc_codewords), dtype=np.uint8)
+    for j in range(length):
+        syndromes = mul[syndromes, roots[None, :]] ^ data[:, j:j+1]
+    return syndromes
+
+def rs_correct(block, ecc_codewords):
+    # (corrected block, errors fixed), ValueError if there are more errors than the code can fix
+    syndromes = rs_syndromes(block, ecc_codewords)
+    if not any(syndromes):
+        return bytes(block), 0
+
+    # Berlekamp-Massey, error locator lowest power first
+    locator, previous = [1], [1]
+    errors, shift, last = 0, 1, 1
+    for k in range(ecc_codewords):
+        delta = syndromes[k]
+        for i in range(1, errors + 1):
+            delta ^= gf_mul(locator[i], syndromes[k - i])
+        if delta == 0:
+            shift += 1
+            continue
+        coef = gf_mul(delta, gf_inverse(last))
+        before = list(locator)
+        locator += [0] * (len(previous) + shift - len(locator))
+        for i, p in enumerate(previous):
+            locator[i + shift] ^= gf_mul(coef, p)
+        if 2 * errors <= k:
+            errors, previous, last, shift = k + 1 - errors, before, delta, 1
+        else:
+            shift += 1
+    if 2 * errors > ecc_codewords:
+        raise ValueError('too many errors in block')
+
+    # Chien search: byte i has power len - 1 - i
+    n = len(block)
+    positions = [i for i in range(n) if _poly_eval(locator, EXP[255 - (n - 1 - i) % 255]) == 0]
+    if len(positions) != errors:
+        raise ValueError('too many errors in block')
+
+    # Forney, with the first root a^0: magnitude = X * omega(1/X) / locator'(1/X)
+    omega = [0] * ecc_codewords
+    for i, s in enumerate(syndromes):
+        for j, l in enumerate(locator[:ecc_codewords - i]):
+            omega[i + j] ^= gf_mul(s, l)
+    derivative = [locator[i] if i % 2 else 0 for i in range(1, len(locator))]
+    fixed = bytearray(block)
+    for i in positions:
+        x = EXP[(n - 1 - i) % 255]
+        x_inv = gf_inverse(x)
+        fixed[i] ^= gf_mul(x, gf_mul(_poly_eval(omega, x_inv), gf_inverse(_poly_eval(derivative, x_inv))))
+    if any(rs_syndromes(fixed, ecc_codewords)):
+        raise ValueError('too many errors in block')
+    return bytes(fixed), errors
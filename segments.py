@@ -0,0 +1,170 @@
+## optimal split of a text into numeric / alphanumeric / byte / kanji segments
+from collections import namedtuple
+from functools import lru_cache
+
+from tables import DATA_CAPACITY_BITS, ECC_LEVELS, MAX_VERSION
+
+Mode = namedtuple('Mode', ['name', 'indicator', 'count_bits'])
+
+# count_bits for versions 1-9, 10-26 and 27-40
+NUMERIC = Mode('numeric', 0b0001, (10, 12, 14))
+ALPHANUMERIC = Mode('alphanumeric', 0b0010, (9, 11, 13))
+BYTE = Mode('byte', 0b0100, (8, 16, 16))
+KANJI = Mode('kanji', 0b1000, (8, 10, 12))
+MODES = (NUMERIC, ALPHANUMERIC, BYTE, KANJI)
+
+VERSION_CLASSES = ((1, 9), (10, 26), (27, 40))
+
+ALPHANUMERIC_CHARS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+ALPHANUMERIC_VALUES = {ch: i for i, ch in enumerate(ALPHANUMERIC_CHARS)}
+
+Segment = namedtuple('Segment', ['mode', 'text'])
+
+# Structured Append header in front of the segments: indicator, position, symbol count - 1, parity byte
+STRUCTURED_APPEND = 0b0011
+STRUCTURED_APPEND_BITS = 20
+
+def version_class(V):
+    return 0 if V <= 9 else 1 if V <= 26 else 2
+
+def max_characters(mode, V, ecc_level):
+    # longest text a single segment of this mode can hold (bytes for byte mode)
+    count_bits = mode.count_bits[version_class(V)]
+    free = DATA_CAPACITY_BITS[ecc_level][V - 1] - 4 - count_bits
+    if mode is NUMERIC:
+        n = free // 10 * 3 + (2 if free % 10 >= 7 else 1 if free % 10 >= 4 else 0)
+    elif mode is ALPHANUMERIC:
+        n = free // 11 * 2 + (1 if free % 11 >= 6 else 0)
+    else:
+        n = free // (8 if mode is BYTE else 13)
+    return min(n, (1 << count_bits) - 1)
+
+# single-mode capacity per (mode name, level), versions 1 - 40 in order so it can be bisected
+CHARACTER_CAPACITY = {
+    (mode.name, ecc): tuple(max_characters(mode, V, ecc) for V in range(1, MAX_VERSION + 1))
+    for mode in MODES for ecc in ECC_LEVELS
+}
+
+def kanji_code(ch):
+    # Shift JIS double byte value if the character has a kanji mode encoding, else None
+    try:
+        encoded = ch.encode('shift_jis')
+    except UnicodeEncodeError:
+        return None
+    if len(encoded) != 2:
+        return None
+    code = (encoded[0] << 8) | encoded[1]
+    if 0x8140 <= code <= 0x9FFC or 0xE040 <= code <= 0xEBBF:
+        return code
+    return None
+
+@lru_cache(maxsize=4096)
+def _char_costs(ch):
+    # cost of one character in each mode, in sixths of a bit, None if the mode can't hold it
+    return (
+        20 if '0' <= ch <= '9' else None,           # 10 bits per 3 digits
+        33 if ch in ALPHANUMERIC_VALUES else None,  # 11 bits per 2 characters
+        48 * len(ch.encode('utf-8')),               # 8 bits per UTF-8 byte
+        78 if kanji_code(ch) is not None else None, # 13 bits
+    )
+
+def make_segments(text, version_cls=0):
+    # dynamic program over the characters, one pass: costs[m] is the cheapest encoding of the
+    # text so far that leaves the encoder in mode m, char_modes the mode each state's last char used
+    if not text:
+        return []
+    if text.isascii() and text.isdigit():
+        # numeric is the cheapest mode for every character, nothing to split; alphanumeric text
+        # still goes through the DP, a long enough digit run is cheaper as its own segment
+        return [Segment(NUMERIC, text)]
+    headers = [(4 + mode.count_bits[version_cls]) * 6 for mode in MODES]
+    costs = list(headers)
+    char_modes = []
+    inf = float('inf')
+    for ch in text:
+        char_costs = _char_costs(ch)
+        new_costs = [inf] * 4
+        modes = [None] * 4
+        for m in range(4):
+            if char_costs[m] is not None:
+                new_costs[m] = costs[m] + char_costs[m]
+                modes[m] = m
+        # switching after this character rounds the old segment up to a whole bit and pays
+        # a header, so the cheapest state is the only one worth switching from
+        frm = min(range(4), key=new_costs.__getitem__)
+        rounded = (new_costs[frm] + 5) // 6 * 6
+        for to in range(4):
+            if rounded + headers[to] < new_costs[to]:
+                new_costs[to] = rounded + headers[to]
+                modes[to] = frm
+        costs = new_costs
+        char_modes.append(modes)
+
+    # walk back from the cheapest final state
+    mode = min(range(4), key=lambda m: costs[m])
+    chosen = [0] * len(text)
+    for i in range(len(text) - 1, -1, -1):
+        mode = chosen[i] = char_modes[i][mode]
+
+    segments = []
+    start = 0
+    for i in range(1, len(text) + 1):
+        if i == len(text) or chosen[i] != chosen[start]:
+            segments.append(Segment(MODES[chosen[start]], text[start:i]))
+            start = i
+    return segments
+
+def _byte_data(text):
+    # byte segments can also carry raw bytes
+    return text if isinstance(text, (bytes, bytearray)) else text.encode('utf-8')
+
+def segment_bits(segment, version_cls):
+    # header + data bits
+    n = len(segment.text)
+    mode = segment.mode
+    if mode is NUMERIC:
+        data = n // 3 * 10 + (0, 4, 7)[n % 3]
+    elif mode is ALPHANUMERIC:
+        data = n // 2 * 11 + (n % 2) * 6
+    elif mode is BYTE:
+        data = len(_byte_data(segment.text)) * 8
+    else:
+        data = n * 13
+    return 4 + mode.count_bits[version_cls] + data
+
+def segment_count(segment):
+    # the character count field counts bytes in byte mode
+    if segment.mode is BYTE:
+        return len(_byte_data(segment.text))
+    return len(segment.text)
+
+def append_header(bits, index, total, parity):
+    # Structured Append header for symbol index (from 0) of total
+    bits.append_bits(STRUCTURED_APPEND, 4)
+    bits.append_bits(index, 4)
+    bits.append_bits(total - 1, 4)
+    bits.append_bits(parity, 8)
+
+def append_segments(bits, segments, version_cls):
+    # mode indicator, character count and data for every segment, into a BitBuffer
+    for segment in segments:
+        mode = segment.mode
+        text = segment.text
+        bits.append_bits(mode.indicator, 4)
+        bits.append_bits(segment_count(segment), mode.count_bits[version_cls])
+        if mode is NUMERIC:
+            for i in range(0, len(text), 3):
+                group = text[i:i+3]
+                bits.append_bits(int(group), (0, 4, 7, 10)[len(group)])
+        elif mode is ALPHANUMERIC:
+            for i in range(0, len(text) - 1, 2):
+                bits.append_bits(ALPHANUMERIC_VALUES[text[i]] * 45 + ALPHANUMERIC_VALUES[text[i+1]], 11)
+            if len(text) % 2:
+                bits.append_bits(ALPHANUMERIC_VALUES[text[-1]], 6)
+        elif mode is BYTE:
+            bits.append_bytes(_byte_data(text))
+        else:
+            for ch in text:
+                code = kanji_code(ch)
+                code -= 0x8140 if code <= 0x9FFC else 0xC140
+                bits.append_bits((code >> 8) * 0xC0 + (code & 0xFF), 13)
@@ -0,0 +1,112 @@
+## per-version layouts, mask planes, the GF(256) multiply table and the decoded logo in one
+## read-only file; every worker mmaps it, so they all share one copy in physical memory
+## and skip rebuilding the layouts at startup
+# python shared.py /dev/shm/qr_shared.bin        build it ahead of time
+# QR_SHARED_FILE=/dev/shm/qr_shared.bin gunicorn "server,py"   or the same with uvicorn asgi:app
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+import basic
+import masking
+import overlay
+import rs
+from matrix import QRMatrix
+from tables import MAX_VERSION
+
+MAGIC = b'QRSHARED'
+FORMAT = 1     # bump when what goes in the file changes
+ALIGN = 64
+
+def _arrays(logo_path):
+    # name -> array for everything that goes in the file
+    arrays = {'mul': rs._mul_table()}
+    for V in range(1, MAX_VERSION + 1):
+        layout = basic.build_layout(V)
+        arrays['grid/%d' % V] = layout.grid.modules
+        arrays['reserved/%d' % V] = layout.reserved
+        arrays['rows/%d' % V] = layout.data_rows.astype(np.int16)
+        arrays['cols/%d' % V] = layout.data_cols.astype(np.int16)
+        arrays['planes/%d' % V] = masking.mask_planes(layout.size)
+        arrays['flips/%d' % V] = masking.data_flips(layout.reserved)
+    if logo_path:
+        arrays['logo'] = overlay.load_logo(logo_path)[1]
+    return arrays
+
+def write_shared(path, logo_path=overlay.DEFAULT_LOGO):
+    # written next to path and renamed into place, so readers never map half a file
+    arrays = _arrays(logo_path)
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        entries[name] = [array.dtype.str, list(array.shape), offset]
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    logo = [logo_path, os.stat(logo_path).st_mtime_ns] if logo_path else None
+    header = json.dumps({'format': FORMAT, 'arrays': entries, 'logo': logo}).encode('utf-8')
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(start + entries[name][2])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(start + offset)
+    os.chmod(tmp, 0o644)  # mkstemp makes it owner-only
+    os.replace(tmp, path)
+
+def load_shared(path):
+    # (name -> read-only array backed by the mapping, header), ValueError if it isn't a current file
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError('%s is not a shared layout file' % path)
+    length, = struct.unpack_from('<Q', mapped, len(MAGIC))
+    header = json.loads(mapped[len(MAGIC) + 8:len(MAGIC) + 8 + length])
+    if header['format'] != FORMAT:
+        raise ValueError('%s has format %s, expected %s' % (path, header['format'], FORMAT))
+    start = -(-(len(MAGIC) + 8 + length) // ALIGN) * ALIGN
+    arrays = {}
+    for name, (dtype, shape, offset) in header['arrays'].items():
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(mapped, dtype=dtype, count=count, offset=start + offset).reshape(shape)
+    return arrays, header
+
+def install(path):
+    # point the per-process caches at the mapped arrays, call before serving
+    arrays, header = load_shared(path)
+    for V in range(1, MAX_VERSION + 1):
+        size = basic.symbol_size(V)
+        grid = QRMatrix(modules=arrays['grid/%d' % V])
+        reserved = arrays['reserved/%d' % V]
+        rows, cols = arrays['rows/%d' % V], arrays['cols/%d' % V]
+        masking._planes[size] = arrays['planes/%d' % V]
+        masking._flips[id(reserved)] = (reserved, arrays['flips/%d' % V])
+        for reserve_logo in (False, True):
+            area = basic.logo_area(size) if reserve_logo and size > 21 else None
+            basic._layouts[(V, reserve_logo)] = basic.Layout(V, size, grid, reserved, rows, cols, area)
+    rs._mul = arrays['mul']
+    if header['logo'] and 'logo' in arrays:
+        logo_path, mtime = header['logo']
+        overlay._decoded[logo_path] = (mtime, arrays['logo'])  # load_logo still re-reads it if the file changed
+
+def install_from_env():
+    # QR_SHARED_FILE names the file, built here the first time; True if one was installed
+    path = os.environ.get('QR_SHARED_FILE')
+    if not path:
+        return False
+    try:
+        install(path)
+    except (OSError, ValueError):
+        write_shared(path)
+        install(path)
+    return True
+
+if __name__ == '__main__':
+    import sys
+    write_shared(sys.argv[1] if len(sys.argv) > 1 else 'qr_shared.bin')
@@ -0,0 +1,93 @@
+## QR code version tables, versions 1 - 40 (index 0 unused)
+from bisect import bisect_left
+from functools import lru_cache
+
+ECC_LEVELS = ['L', 'M', 'Q', 'H']
+
+# error correction codewords in each block
+ECC_CODEWORDS_PER_BLOCK = {
+    'L': (0, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28, 28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    'M': (0, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26, 26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    'Q': (0, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30, 28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    'H': (0, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28, 30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+}
+
+# number of RS blocks the codewords are split into
+NUM_BLOCKS = {
+    'L': (0, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8, 8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    'M': (0, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16, 17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    'Q': (0, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20, 23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    'H': (0, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25, 25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+}
+
+# alignment pattern centres, used as both row and column coordinates
+ALIGNMENT_POSITIONS = (
+    (), (), (6, 18), (6, 22), (6, 26), (6, 30), (6, 34),
+    (6, 22, 38), (6, 24, 42), (6, 26, 46), (6, 28, 50), (6, 30, 54), (6, 32, 58), (6, 34, 62),
+    (6, 26, 46, 66), (6, 26, 48, 70), (6, 26, 50, 74), (6, 30, 54, 78), (6, 30, 56, 82), (6, 30, 58, 86), (6, 34, 62, 90),
+    (6, 28, 50, 72, 94), (6, 26, 50, 74, 98), (6, 30, 54, 78, 102), (6, 28, 54, 80, 106), (6, 32, 58, 84, 110), (6, 30, 58, 86, 114), (6, 34, 62, 90, 118),
+    (6, 26, 50, 74, 98, 122), (6, 30, 54, 78, 102, 126), (6, 26, 52, 78, 104, 130), (6, 30, 56, 82, 108, 134), (6, 34, 60, 86, 112, 138), (6, 30, 58, 86, 114, 142), (6, 34, 62, 90, 118, 146),
+    (6, 30, 54, 78, 102, 126, 150), (6, 24, 50, 76, 102, 128, 154), (6, 28, 54, 80, 106, 132, 158), (6, 32, 58, 84, 110, 136, 162), (6, 26, 54, 82, 110, 138, 166), (6, 30, 58, 86, 114, 142, 170),
+)
+
+MAX_VERSION = 40
+
+def symbol_size(V):
+    return ((V - 1) * 4) + 21
+
+def total_codewords(V):
+    # modules left after function patterns, format and version info
+    modules = (16 * V + 128) * V + 64
+    if V >= 2:
+        n = V // 7 + 2
+        modules -= (25 * n - 10) * n - 55
+        if V >= 7:
+            modules -= 36
+    return modules // 8
+
+TOTAL_CODEWORDS = tuple(total_codewords(V) if V else 0 for V in range(MAX_VERSION + 1))
+
+# data codewords per (level)[version]
+DATA_CODEWORDS = {
+    ecc: tuple(TOTAL_CODEWORDS[V] - ECC_CODEWORDS_PER_BLOCK[ecc][V] * NUM_BLOCKS[ecc][V] if V else 0 for V in range(MAX_VERSION + 1))
+    for ecc in ECC_LEVELS
+}
+
+# data capacity in bits, versions 1 - 40 in order so it can be bisected
+DATA_CAPACITY_BITS = {ecc: tuple(n * 8 for n in DATA_CODEWORDS[ecc][1:]) for ecc in ECC_LEVELS}
+
+def smallest_version(bits, ecc_level, first=1, last=MAX_VERSION):
+    # smallest version in first..last whose data capacity holds bits, None if none of them does
+    V = max(first, bisect_left(DATA_CAPACITY_BITS[ecc_level], bits) + 1)
+    return V if V <= last else None
+
+@lru_cache(maxsize=None)
+def block_lengths(V, ecc_level):
+    # data codewords in each block, short blocks first
+    blocks = NUM_BLOCKS[ecc_level][V]
+    data = DATA_CODEWORDS[ecc_level][V]
+    short = data // blocks
+    num_long = data % blocks
+    return (short,) * (blocks - num_long) + (short + 1,) * num_long
+
+def bch_remainder(value, generator):
+    # remainder of value * x^degree divided by generator, degree being the generator's
+    degree = generator.bit_length() - 1
+    value <<= degree
+    for i in range(value.bit_length() - 1, degree - 1, -1):
+        if (value >> i) & 1:
+            value ^= generator << (i - degree)
+    return value
+
+# format information, 2 level bits + 3 mask bits + BCH(15, 5) remainder, xor 0x5412
+ECC_FORMAT_BITS = {'L': 0b01, 'M': 0b00, 'Q': 0b11, 'H': 0b10}
+FORMAT_GENERATOR = 0b10100110111
+FORMAT_MASK = 0b101010000010010
+FORMAT_WORDS = {
+    (ecc, mask): (((ECC_FORMAT_BITS[ecc] << 3 | mask) << 10) | bch_remainder(ECC_FORMAT_BITS[ecc] << 3 | mask, FORMAT_GENERATOR)) ^ FORMAT_MASK
+    for ecc in ECC_LEVELS for mask in range(8)
+}
+
+# version information, 6 version bits + BCH(18, 6) remainder, versions 7 - 40 (None below)
+VERSION_GENERATOR = 0b1111100100101
+VERSION_WORDS = tuple((V << 12) | bch_remainder(V, VERSION_GENERATOR) if V >= 7 else None for V in range(MAX_VERSION + 1))